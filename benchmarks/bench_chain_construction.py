@@ -0,0 +1,49 @@
+"""
+Compares the per-message construction cost of the retrieval chain before and
+after Chatbot kept it alive. No request is sent to OpenAI.
+
+    python benchmarks/bench_chain_construction.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from langchain.chains import ConversationalRetrievalChain
+from langchain.chat_models import ChatOpenAI
+from langchain.embeddings import FakeEmbeddings
+from langchain.vectorstores import FAISS
+
+from modules.chatbot import Chatbot
+
+MESSAGES = 200
+
+
+def per_message_chain(chatbot):
+    # What conversational_chat used to do for every question
+    llm = ChatOpenAI(model_name=chatbot.model_name, temperature=chatbot.temperature)
+    retriever = chatbot.vectors.as_retriever()
+    return ConversationalRetrievalChain.from_llm(llm=llm,
+        retriever=retriever, verbose=True, return_source_documents=True, max_tokens_limit=4097, combine_docs_chain_kwargs={'prompt': chatbot.QA_PROMPT})
+
+
+def measure(build):
+    start = time.perf_counter()
+    for _ in range(MESSAGES):
+        build()
+    return (time.perf_counter() - start) / MESSAGES * 1000
+
+
+if __name__ == "__main__":
+    texts = [f"chunk {i} of a sample document" for i in range(1000)]
+    vectors = FAISS.from_texts(texts, FakeEmbeddings(size=1536))
+    chatbot = Chatbot("gpt-3.5-turbo", 0.0, vectors)
+
+    before = measure(lambda: per_message_chain(chatbot))
+    after = measure(lambda: chatbot.chain)
+
+    print(f"chain construction per message, {MESSAGES} messages")
+    print(f"  before (rebuilt every question): {before:.3f} ms")
+    print(f"  after  (long-lived chain):       {after:.3f} ms")
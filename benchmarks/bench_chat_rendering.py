@@ -0,0 +1,55 @@
+"""
+Script-side time to draw a conversation on a rerun, drawing every message versus
+ChatRenderer, against the number of turns. Runs Streamlit in bare mode, the browser
+cost of each chat bubble (an iframe) comes on top and grows the same way.
+
+    python benchmarks/bench_chat_rendering.py
+"""
+import logging
+import time
+
+import common  # noqa: F401, sets up the import path
+
+import streamlit as st
+from streamlit_chat import message
+
+from modules.chat_render import ChatRenderer
+
+TURN_COUNTS = [10, 100, 1000, 5000]
+RERUNS = 5
+
+
+def draw_turn(i, user, assistant):
+    message(user, is_user=True, key=f"history_{i}_user", avatar_style="big-smile")
+    message(assistant, key=str(i), avatar_style="thumbs")
+
+
+def draw_all(users, assistants):
+    # What ChatHistory.generate_messages used to do on every rerun
+    for i in range(len(assistants)):
+        draw_turn(i, users[i], assistants[i])
+
+
+def draw_incremental(users, assistants):
+    ChatRenderer("bench").render(st.container(), len(assistants), lambda i: (users[i], assistants[i]), draw_turn)
+
+
+def measure(draw, users, assistants):
+    # The first rerun builds the renderer's pages, later reruns reuse them
+    draw(users, assistants)
+    start = time.perf_counter()
+    for _ in range(RERUNS):
+        draw(users, assistants)
+    return (time.perf_counter() - start) / RERUNS * 1000
+
+
+if __name__ == "__main__":
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    print(f"{'turns':>6} {'all messages':>14} {'incremental':>13}")
+    for turns in TURN_COUNTS:
+        users = [f"Question {i} about the quarterly report?" for i in range(turns)]
+        assistants = [f"Answer {i}: revenue grew in every region, see the summary table. " * 3 for i in range(turns)]
+        st.session_state.clear()
+        everything = measure(draw_all, users, assistants)
+        incremental = measure(draw_incremental, users, assistants)
+        print(f"{turns:>6} {everything:>12.1f}ms {incremental:>11.1f}ms")
@@ -0,0 +1,89 @@
+"""
+Recall@k and query latency of dense, BM25 and hybrid (reciprocal rank fusion)
+retrieval on a sample corpus of order rows and prose, for order id lookups and
+for prose questions. Also reports how many of the fetched chunks pass the
+packer's distance cut-off, the chunks that can end up in the prompt.
+
+    python benchmarks/bench_hybrid_retrieval.py
+"""
+import time
+import random
+
+from common import HashingEmbeddings, sample_corpus
+
+from langchain.vectorstores import FAISS
+
+from modules.context import ContextPacker
+from modules.lexical import BM25Index, hybrid_search
+
+CORPUS_SIZE = 4000
+QUERIES = 300
+K = 4
+FETCH_K = 20
+PROSE_QUERY_WORDS = 12
+
+
+def evaluate(search, queries):
+    found, start = 0, time.perf_counter()
+    for query, expected in queries:
+        if expected in search(query):
+            found += 1
+    elapsed = (time.perf_counter() - start) / len(queries) * 1000
+    return found / len(queries), elapsed
+
+
+def prose_question(chunk, rng):
+    # A run of words from the chunk, asked the way a user would
+    words = chunk.split()
+    start = rng.randrange(len(words) - PROSE_QUERY_WORDS)
+    return "What does the document say about " + " ".join(words[start:start + PROSE_QUERY_WORDS]) + "?"
+
+
+def kept_chunks(scored_search, queries, packer):
+    """
+    Average number of fetched chunks the distance cut-off lets into the prompt
+    """
+    return sum(len(packer.within_distance(scored_search(query))) for query, _ in queries) / len(queries)
+
+
+if __name__ == "__main__":
+    chunks, order_ids = sample_corpus(CORPUS_SIZE)
+    vectors = FAISS.from_texts(chunks, HashingEmbeddings())
+    vectors.lexical_index = BM25Index()
+    for chunk in chunks:
+        vectors.lexical_index.add(chunk)
+
+    rng = random.Random(1)
+    order_positions = {position for _, position in order_ids}
+    workloads = {
+        "order id lookups": [(f"What did the customer of order {order_id} buy?", chunks[position])
+                             for order_id, position in rng.sample(order_ids, QUERIES)],
+        "prose questions": [(prose_question(chunks[position], rng), chunks[position])
+                            for position in rng.sample(sorted(set(range(len(chunks))) - order_positions), QUERIES)],
+    }
+    packer = ContextPacker("gpt-3.5-turbo", fetch_k=FETCH_K)
+
+    def dense(query):
+        return [doc.page_content for doc in vectors.similarity_search(query, k=K)]
+
+    def lexical(query):
+        return [chunks[position] for position, _ in vectors.lexical_index.search(query, K)]
+
+    def hybrid(query):
+        return [doc.page_content for doc, _ in hybrid_search(vectors, query, k=FETCH_K)[:K]]
+
+    def dense_scored(query):
+        return vectors.similarity_search_with_score(query, k=FETCH_K)
+
+    def hybrid_scored(query):
+        return hybrid_search(vectors, query, k=FETCH_K)
+
+    for workload, queries in workloads.items():
+        print(f"{CORPUS_SIZE} chunks, {QUERIES} {workload}, recall@{K}")
+        for name, search in [("dense", dense), ("bm25", lexical), ("hybrid", hybrid)]:
+            recall, latency = evaluate(search, queries)
+            print(f"  {name:<7} recall@{K} {recall:.2f}   {latency:.2f} ms/query")
+        print(
+            f"  chunks of {FETCH_K} passing the distance cut-off: dense {kept_chunks(dense_scored, queries, packer):.1f}, "
+            f"hybrid {kept_chunks(hybrid_scored, queries, packer):.1f}"
+        )
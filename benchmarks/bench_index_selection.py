@@ -0,0 +1,64 @@
+"""
+Build time, query latency, memory and recall@10 of the index types Embedder
+can pick, against the exact flat baseline, on clustered random vectors.
+
+    python benchmarks/bench_index_selection.py [vector count] [dimension]
+"""
+import sys
+import time
+
+from common import random_vectors
+
+import faiss
+import numpy as np
+
+from modules.indexing import build_index, estimate_index_bytes, train_and_add
+
+K = 10
+QUERIES = 200
+
+
+def clustered_vectors(count, dim, clusters=200):
+    # Real embeddings are clustered by topic, uniform random vectors are a worst case for ANN
+    centers = random_vectors(clusters, dim, seed=1)
+    noise = random_vectors(count, dim, seed=2) * 0.35
+    return (centers[np.random.default_rng(3).integers(0, clusters, count)] + noise).astype(np.float32)
+
+
+def measure(index, vectors, queries):
+    start = time.perf_counter()
+    train_and_add(index, vectors)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for query in queries:
+        index.search(query[None, :], K)
+    latency = (time.perf_counter() - start) / len(queries) * 1000
+
+    _, found = index.search(queries, K)
+    return build, latency, found
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    dim = int(sys.argv[2]) if len(sys.argv) > 2 else 384
+    vectors = clustered_vectors(count, dim)
+    queries = vectors[np.random.default_rng(4).choice(count, QUERIES, replace=False)] + 0.01
+
+    candidates = [
+        ("flat (baseline)", faiss.IndexFlatL2(dim)),
+        ("hnsw", build_index(dim, max(count, 20000))),
+        ("ivf + fp16", build_index(dim, max(count, 20000), "fp16")),
+        ("ivf + pq", build_index(dim, max(count, 20000), "pq")),
+    ]
+
+    print(f"{count} vectors of dimension {dim}, {QUERIES} queries, recall@{K} against flat")
+    print(f"  {'index':<16}{'build s':>9}{'query ms':>10}{'memory MB':>11}{'recall':>8}")
+    baseline = None
+    for name, index in candidates:
+        build, latency, found = measure(index, vectors, queries)
+        if baseline is None:
+            baseline = found
+        recall = np.mean([len(set(a) & set(b)) / K for a, b in zip(found, baseline)])
+        memory = estimate_index_bytes(index) / 1024 / 1024
+        print(f"  {name:<16}{build:>9.2f}{latency:>10.3f}{memory:>11.1f}{recall:>8.3f}")
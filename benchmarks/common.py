@@ -0,0 +1,65 @@
+"""
+Helpers shared by the benchmarks, they run offline without an OpenAI key.
+"""
+import os
+import re
+import sys
+import random
+import hashlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+CITIES = ["Paris", "Lyon", "Berlin", "Madrid", "Lisbon", "Rome", "Vienna", "Prague", "Oslo", "Dublin"]
+PRODUCTS = ["laptop", "monitor", "keyboard", "printer", "router", "camera", "tablet", "headset", "charger", "speaker"]
+NAMES = ["Alice", "Bruno", "Chloe", "David", "Emma", "Farid", "Gina", "Hugo", "Ines", "Jonas"]
+WORDS = ("report revenue quarter growth market strategy customer product team release budget forecast "
+         "margin region sales support contract delivery invoice supplier inventory risk audit").split()
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Deterministic local stand-in for OpenAIEmbeddings: hashed bag of words, L2 normalized
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+
+    def embed_query(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.size] += 1 if digest[4] % 2 else -1
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+def sample_corpus(size, seed=0):
+    """
+    Returns chunks mixing CSV-like order rows and prose, and the order ids
+    """
+    rng = random.Random(seed)
+    chunks, order_ids = [], []
+    for i in range(size):
+        if i % 2 == 0:
+            order_id = f"ORD-{10000 + i}"
+            order_ids.append((order_id, i))
+            chunks.append(
+                f"Order {order_id}: customer {rng.choice(NAMES)} bought {rng.randint(1, 9)} "
+                f"{rng.choice(PRODUCTS)} shipped to {rng.choice(CITIES)}"
+            )
+        else:
+            chunks.append(" ".join(rng.choice(WORDS) for _ in range(60)))
+    return chunks, order_ids
+
+
+def random_vectors(count, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
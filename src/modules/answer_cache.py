@@ -0,0 +1,143 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def normalize_question(question):
+    question = re.sub(r"[^\w\s]", " ", question.lower())
+    return " ".join(question.split())
+
+
+def unit_vector(embedding):
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else None
+
+
+class AnswerCache:
+    """
+    Process-wide cache of answers keyed by (document, model, temperature, normalized
+    question), with TTL and LRU eviction. When a similarity threshold is set, a
+    question missing from the cache is also matched against the embeddings of
+    the cached questions of the same document, kept as one matrix per document so
+    that a lookup is a single matrix product. Answers sampled with a temperature
+    above 0 are never cached
+    """
+
+    def __init__(self, max_entries=2048, ttl=24 * 3600, similarity_threshold=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.entries = OrderedDict()
+        # (doc_key, model, temperature) -> (keys, unit embeddings matrix, creation times)
+        self.embeddings = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def is_cacheable(doc_key, temperature):
+        return doc_key is not None and temperature == 0
+
+    def _expired(self, entry):
+        return time.time() - entry["created"] > self.ttl
+
+    def embed(self, question, embed_query):
+        """
+        Returns the embedding used for similarity lookups, None when they are disabled
+        """
+        return embed_query(question) if self.similarity_threshold is not None else None
+
+    def get(self, doc_key, model, temperature, question, embedding=None):
+        """
+        Returns the cached entry of a question, or None
+        """
+        if not self.is_cacheable(doc_key, temperature):
+            return None
+        key = (doc_key, model, temperature, normalize_question(question))
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self._expired(entry):
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                return self._hit(key, entry)
+            group = self.embeddings.get(key[:3]) if embedding is not None else None
+
+        # The matrices are replaced, never changed in place, they are searched outside the lock
+        similar_key = self._most_similar(group, embedding) if group is not None else None
+        with self.lock:
+            entry = self.entries.get(similar_key) if similar_key is not None else None
+            if entry is None or self._expired(entry):
+                self.misses += 1
+                return None
+            return self._hit(similar_key, entry)
+
+    def _hit(self, key, entry):
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def _most_similar(self, group, embedding):
+        query = unit_vector(embedding)
+        if query is None:
+            return None
+        keys, matrix, created = group
+        similarities = matrix @ query
+        similarities[created < time.time() - self.ttl] = -np.inf
+        best = int(np.argmax(similarities))
+        return keys[best] if similarities[best] >= self.similarity_threshold else None
+
+    def _add_embedding(self, key, embedding, created):
+        vector = unit_vector(embedding)
+        if vector is None:
+            return
+        group = key[:3]
+        keys, matrix, times = self.embeddings.get(group, ([], np.empty((0, len(vector)), dtype=np.float32), np.empty(0)))
+        self.embeddings[group] = (keys + [key], np.vstack([matrix, vector]), np.append(times, created))
+
+    def _remove(self, key):
+        del self.entries[key]
+        group = self.embeddings.get(key[:3])
+        if group is None or key not in group[0]:
+            return
+        keys, matrix, times = group
+        row = keys.index(key)
+        if len(keys) == 1:
+            del self.embeddings[key[:3]]
+        else:
+            self.embeddings[key[:3]] = (keys[:row] + keys[row + 1:], np.delete(matrix, row, axis=0), np.delete(times, row))
+
+    def put(self, doc_key, model, temperature, question, answer, source_documents, embedding=None):
+        if not self.is_cacheable(doc_key, temperature):
+            return
+        key = (doc_key, model, temperature, normalize_question(question))
+        created = time.time()
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = {
+                "answer": answer,
+                "source_documents": source_documents,
+                "created": created,
+            }
+            if embedding is not None:
+                self._add_embedding(key, embedding, created)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+_threshold = os.environ.get("ROBBY_ANSWER_CACHE_SIMILARITY")
+ANSWER_CACHE = AnswerCache(
+    max_entries=int(os.environ.get("ROBBY_ANSWER_CACHE_ENTRIES", "2048")),
+    ttl=int(os.environ.get("ROBBY_ANSWER_CACHE_TTL", str(24 * 3600))),
+    similarity_threshold=float(_threshold) if _threshold else None,
+)
@@ -0,0 +1,107 @@
+import time
+import queue
+import threading
+from contextlib import contextmanager, nullcontext
+from langchain.callbacks.base import BaseCallbackHandler
+
+from modules.tokens import count_tokens
+
+class StreamHandler(BaseCallbackHandler):
+    """
+    Writes the answer tokens into a Streamlit placeholder as they arrive
+    """
+
+    def __init__(self, container, initial_text=""):
+        self.container = container
+        self.text = initial_text
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.text += token
+        self.container.markdown(self.text + "▌")
+
+
+class QueueHandler(BaseCallbackHandler):
+    """
+    Pushes the answer tokens into a queue for generator based callers
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.queue.put(token)
+
+
+class TraceHandler(BaseCallbackHandler):
+    """
+    Records the steps of one request (condensing, retrieval, each LLM call) with
+    their timings and token counts. Each request gets its own handler, so traces
+    of concurrent sessions never mix and nothing has to be printed
+    """
+
+    def __init__(self):
+        self.steps = []
+        self.llm_steps = {}
+        self.current = []
+        self.lock = threading.Lock()
+
+    def _add(self, name, **details):
+        step = {"step": name, "within": self.current[-1]["step"] if self.current else "", "seconds": None, **details}
+        with self.lock:
+            self.steps.append(step)
+        return step
+
+    @contextmanager
+    def step(self, name, **details):
+        """
+        Times a step, details can be added to the yielded dict while it runs
+        """
+        step = self._add(name, **details)
+        self.current.append(step)
+        start = time.perf_counter()
+        try:
+            yield step
+        finally:
+            step["seconds"] = time.perf_counter() - start
+            self.current.pop()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, invocation_params=None, **kwargs):
+        model = (invocation_params or {}).get("model_name") or serialized.get("name", "")
+        step = self._add(
+            "llm", model=model, prompt_tokens=sum(count_tokens(prompt, model) for prompt in prompts), completion_tokens=0
+        )
+        self.llm_steps[run_id] = (step, time.perf_counter())
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        # Streamed responses carry no usage, each token arrives on its own
+        if run_id in self.llm_steps:
+            self.llm_steps[run_id][0]["completion_tokens"] += 1
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        step, start = self.llm_steps.pop(run_id, (None, None))
+        if step is None:
+            return
+        step["seconds"] = time.perf_counter() - start
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        step["prompt_tokens"] = usage.get("prompt_tokens", step["prompt_tokens"])
+        step["completion_tokens"] = usage.get("completion_tokens", step["completion_tokens"])
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        step, start = self.llm_steps.pop(run_id, (None, None))
+        if step is not None:
+            step["seconds"] = time.perf_counter() - start
+            step["error"] = str(error)
+
+    def rows(self):
+        """
+        Returns the steps as table rows, in the order they started
+        """
+        with self.lock:
+            return [dict(step) for step in self.steps]
+
+
+def trace_step(trace, name, **details):
+    """
+    trace.step() when the request is traced, a no-op otherwise
+    """
+    return trace.step(name, **details) if trace is not None else nullcontext(dict(details))
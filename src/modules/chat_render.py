@@ -0,0 +1,62 @@
+import streamlit as st
+
+# Latest turns drawn as chat bubbles
+RECENT_TURNS = 10
+# Older turns are grouped in pages of this many turns
+PAGE_TURNS = 25
+
+
+def format_turn(user, assistant):
+    return f"**You:** {user}\n\n**Robby:** {assistant}"
+
+
+class ChatRenderer:
+    """
+    Draws a conversation at a cost that does not grow with its length. The latest
+    turns are chat bubbles, older turns are grouped in pages of markdown that are
+    built once, kept in session state, and only drawn when the user opens them
+    """
+
+    def __init__(self, namespace, recent_turns=RECENT_TURNS, page_turns=PAGE_TURNS):
+        self.namespace = namespace
+        self.recent_turns = recent_turns
+        self.page_turns = page_turns
+
+    @property
+    def state(self):
+        return st.session_state.setdefault(f"{self.namespace}_rendered", {"turns": 0, "pages": []})
+
+    def older_pages(self, turn_count, get_turn):
+        """
+        Returns the markdown of every full page of turns before the recent ones,
+        only pages completed since the last rerun are built
+        """
+        state = self.state
+        if turn_count < state["turns"]:
+            # The conversation was reset
+            state["pages"] = []
+        state["turns"] = turn_count
+
+        pages = state["pages"]
+        full_pages = max(0, turn_count - self.recent_turns) // self.page_turns
+        while len(pages) < full_pages:
+            start = len(pages) * self.page_turns
+            pages.append("\n\n---\n\n".join(format_turn(*get_turn(i)) for i in range(start, start + self.page_turns)))
+        return pages
+
+    def render(self, container, turn_count, get_turn, draw_turn):
+        """
+        get_turn(i) returns the (user, assistant) messages of turn i,
+        draw_turn(i, user, assistant) draws a recent turn
+        """
+        pages = self.older_pages(turn_count, get_turn)
+        first_recent = len(pages) * self.page_turns
+        with container:
+            if pages:
+                with st.expander(f"Earlier messages ({first_recent})"):
+                    page = st.number_input(
+                        "Page", min_value=1, max_value=len(pages), value=len(pages), key=f"{self.namespace}_history_page"
+                    )
+                    st.markdown(pages[page - 1])
+            for i in range(first_recent, turn_count):
+                draw_turn(i, *get_turn(i))
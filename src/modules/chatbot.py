@@ -1,19 +1,52 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import openai
+import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
 from langchain.chat_models import ChatOpenAI
 from langchain.chains import ConversationalRetrievalChain
+from langchain.chains.llm import LLMChain
+from langchain.chains.question_answering import load_qa_chain
+from langchain.chains.conversational_retrieval.prompts import CONDENSE_QUESTION_PROMPT
+from langchain.memory.prompt import SUMMARY_PROMPT
 from langchain.prompts.prompt import PromptTemplate
 from langchain.callbacks import get_openai_callback
 
+from modules.answer_cache import ANSWER_CACHE, normalize_question
+from modules.callbacks import QueueHandler, TraceHandler, trace_step
+from modules.condense import CONDENSE_MODEL, DEFAULT_CONDENSE_STRATEGY, is_self_contained
+from modules.context import ContextPacker, PackedRetriever
+from modules.memory import ConversationMemory, format_turns
+from modules.tokens import count_tokens
+
 #fix Error: module 'langchain' has no attribute 'verbose'
 import langchain
 langchain.verbose = False
 
+# openai keeps one requests session per thread and Streamlit runs every rerun in a new
+# thread, share a single connection pool so each message doesn't pay for a new TLS handshake
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+openai.requestssession = HTTP_SESSION
+
+# Runs the speculative retrievals of the "speculative" condensing strategy
+SPECULATIVE_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculative-retrieval")
+
 class Chatbot:
 
-    def __init__(self, model_name, temperature, vectors):
+    def __init__(self, model_name, temperature, vectors, doc_key=None):
         self.model_name = model_name
         self.temperature = temperature
         self.vectors = vectors
+        # Identifies the document in the answer cache, answers are not cached without it
+        self.doc_key = doc_key
+        self._chain = None
+        self._chain_config = None
+        self._chain_lock = threading.Lock()
+        self._cheap_question_generator = None
+        self._summary_chain = None
 
     qa_template = """
         You are a helpful AI assistant named Robby. The user gives you a file its content is represented by the following pieces of context, use them to answer the question at the end.
@@ -29,24 +62,236 @@ class Chatbot:
 
     QA_PROMPT = PromptTemplate(template=qa_template, input_variables=["context","question" ])
 
-    def conversational_chat(self, query):
+    def build_chain(self):
+        """
+        Builds the LLM client and the retrieval chain
+        """
+        # Only the answer is streamed, the condensed question is an intermediate step
+        llm = ChatOpenAI(model_name=self.model_name, temperature=self.temperature, streaming=True)
+        condense_llm = ChatOpenAI(model_name=self.model_name, temperature=self.temperature)
+
+        # Fills the model's own context window instead of a fixed 4097 token limit
+        retriever = PackedRetriever(self.vectors, ContextPacker(self.model_name), self.qa_template)
+
+        return ConversationalRetrievalChain(
+            retriever=retriever,
+            combine_docs_chain=load_qa_chain(llm, chain_type="stuff", prompt=self.QA_PROMPT),
+            question_generator=LLMChain(llm=condense_llm, prompt=CONDENSE_QUESTION_PROMPT),
+            return_source_documents=True)
+
+    @property
+    def chain(self):
+        """
+        Returns the long-lived chain, rebuilt only when the model, temperature or vectors change
+        """
+        with self._chain_lock:
+            config = (self.model_name, self.temperature, id(self.vectors))
+            if self._chain is None or self._chain_config != config:
+                self._chain = self.build_chain()
+                self._chain_config = config
+                self._cheap_question_generator = None
+            return self._chain
+
+    @property
+    def cheap_question_generator(self):
+        """
+        Returns the question condensing chain of the "cheap" strategy
+        """
+        chain = self.chain
+        if self.model_name == CONDENSE_MODEL:
+            return chain.question_generator
+        with self._chain_lock:
+            if self._cheap_question_generator is None:
+                condense_llm = ChatOpenAI(model_name=CONDENSE_MODEL, temperature=self.temperature)
+                self._cheap_question_generator = LLMChain(llm=condense_llm, prompt=CONDENSE_QUESTION_PROMPT)
+            return self._cheap_question_generator
+
+    @property
+    def summary_chain(self):
+        """
+        Returns the chain folding old turns into the conversation summary
+        """
+        with self._chain_lock:
+            if self._summary_chain is None:
+                llm = ChatOpenAI(model_name=CONDENSE_MODEL, temperature=0)
+                self._summary_chain = LLMChain(llm=llm, prompt=SUMMARY_PROMPT)
+            return self._summary_chain
+
+    def summarize(self, summary, new_lines):
+        return self.summary_chain.run(summary=summary, new_lines=new_lines)
+
+    @staticmethod
+    def format_chat_history(chat_history):
+        if isinstance(chat_history, ConversationMemory):
+            return chat_history.to_prompt()
+        return format_turns(chat_history)
+
+    def remember(self, chat_history, query, answer):
+        """
+        Appends a turn to the chat history, a ConversationMemory then summarizes
+        the turns leaving its window in the background
+        """
+        chat_history.append((query, answer))
+        if isinstance(chat_history, ConversationMemory):
+            chat_history.summarize_in_background(self.summarize)
+
+    def condense(self, query, chat_history, strategy=DEFAULT_CONDENSE_STRATEGY, callbacks=None):
+        """
+        Rewrites a follow-up question as a standalone question
+        """
+        if not chat_history or (strategy == "skip" and is_self_contained(query)):
+            return query
+        question_generator = self.cheap_question_generator if strategy == "cheap" else self.chain.question_generator
+        return question_generator.run(
+            question=query, chat_history=self.format_chat_history(chat_history), callbacks=callbacks
+        )
+
+    def answer(self, query, chat_history, callbacks=None, condense_strategy=DEFAULT_CONDENSE_STRATEGY, trace=None):
         """
-        Start a conversational chat with a model via Langchain
+        Answers a question given the previous (question, answer) turns. The result
+        also holds the source documents, the tokens of context they used and the
+        time spent in each step. Repeated questions about the same document are
+        served from the answer cache. trace, a TraceHandler, records each step
         """
-        llm = ChatOpenAI(model_name=self.model_name, temperature=self.temperature)
+        chain = self.chain
+        timings = {"strategy": condense_strategy}
+        start = time.perf_counter()
+        if trace is not None:
+            callbacks = list(callbacks or []) + [trace]
 
-        retriever = self.vectors.as_retriever()
+        speculative_docs = None
+        if condense_strategy == "speculative" and chat_history:
+            speculative_docs = SPECULATIVE_EXECUTOR.submit(chain.retriever.get_relevant_documents, query)
+        with trace_step(trace, "condense", strategy=condense_strategy) as step:
+            question = self.condense(query, chat_history, condense_strategy, callbacks=callbacks)
+            step["question"] = question
+        timings["condense"] = time.perf_counter() - start
 
+        embedding = None
+        if ANSWER_CACHE.is_cacheable(self.doc_key, self.temperature):
+            embedding = ANSWER_CACHE.embed(question, self.vectors.embedding_function)
+        cached = ANSWER_CACHE.get(self.doc_key, self.model_name, self.temperature, question, embedding)
+        if cached is not None:
+            with trace_step(trace, "answer cache", hit=True):
+                pass
+            timings["total"] = time.perf_counter() - start
+            return {
+                "answer": cached["answer"],
+                "source_documents": cached["source_documents"],
+                "usage": {"chunks": len(cached["source_documents"]), "context_tokens": 0, "prompt_tokens": 0, "cached": True},
+                "timings": timings,
+            }
 
-        chain = ConversationalRetrievalChain.from_llm(llm=llm,
-            retriever=retriever, verbose=True, return_source_documents=True, max_tokens_limit=4097, combine_docs_chain_kwargs={'prompt': self.QA_PROMPT})
+        retrieve_start = time.perf_counter()
+        with trace_step(trace, "retrieve") as step:
+            if speculative_docs is not None and normalize_question(question) == normalize_question(query):
+                # The history didn't change the question, the speculative retrieval is the right one
+                docs = speculative_docs.result()
+                step["speculative"] = True
+            else:
+                docs = chain.retriever.get_relevant_documents(question)
+            context_tokens = sum(doc.metadata.get("tokens", 0) for doc in docs)
+            step.update(chunks=len(docs), context_tokens=context_tokens)
+        timings["retrieve"] = time.perf_counter() - retrieve_start
 
-        chain_input = {"question": query, "chat_history": st.session_state["history"]}
-        result = chain(chain_input)
+        answer_start = time.perf_counter()
+        with trace_step(trace, "answer"):
+            answer = chain.combine_docs_chain.run(input_documents=docs, question=question, callbacks=callbacks)
+        timings["answer"] = time.perf_counter() - answer_start
+        timings["total"] = time.perf_counter() - start
 
-        st.session_state["history"].append((query, result["answer"]))
+        ANSWER_CACHE.put(self.doc_key, self.model_name, self.temperature, question, answer, docs, embedding)
+        return {
+            "answer": answer,
+            "source_documents": docs,
+            "usage": {
+                "chunks": len(docs),
+                "context_tokens": context_tokens,
+                "prompt_tokens": context_tokens + count_tokens(self.qa_template + question, self.model_name),
+                "cached": False,
+            },
+            "timings": timings,
+        }
+
+    def conversational_chat(self, query, callbacks=None, chat_history=None):
+        """
+        Start a conversational chat with a model via Langchain,
+        callbacks receive the answer tokens as they are generated.
+        chat_history defaults to the session's "history"
+        """
+        if chat_history is None:
+            chat_history = st.session_state["history"]
+        strategy = st.session_state.get("condense_strategy", DEFAULT_CONDENSE_STRATEGY)
+        # Traced per request, the page shows the steps of the last answer
+        trace = TraceHandler()
+        result = self.answer(query, chat_history, callbacks=callbacks, condense_strategy=strategy, trace=trace)
+        answer = result["answer"]
+        st.session_state["last_trace"] = trace.rows()
+
+        self.remember(chat_history, query, answer)
+        st.session_state["last_usage"] = result["usage"]
+        st.session_state["last_timings"] = result["timings"]
+        st.session_state.setdefault("latency_by_strategy", {}).setdefault(strategy, []).append(result["timings"]["total"])
         #count_tokens_chain(chain, chain_input)
-        return result["answer"]
+        return answer
+
+    def stream_chat(self, query, chat_history, condense_strategy=DEFAULT_CONDENSE_STRATEGY, trace=None):
+        """
+        Yields the answer tokens as they are generated, for callers outside Streamlit.
+        The turn is appended to chat_history, a list or a ConversationMemory, once
+        the answer is complete. trace, a TraceHandler, records the steps of the turn
+        """
+        handler = QueueHandler()
+        done = object()
+        outcome = {}
+
+        def run():
+            try:
+                result = self.answer(
+                    query, chat_history, callbacks=[handler], condense_strategy=condense_strategy, trace=trace
+                )
+                outcome["answer"] = result["answer"]
+                if result["usage"]["cached"]:
+                    # Nothing was generated, hand over the whole cached answer at once
+                    handler.queue.put(result["answer"])
+            except Exception as e:
+                outcome["error"] = e
+            finally:
+                handler.queue.put(done)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        while True:
+            token = handler.queue.get()
+            if token is done:
+                break
+            yield token
+        thread.join()
+
+        if "error" in outcome:
+            raise outcome["error"]
+        self.remember(chat_history, query, outcome["answer"])
+
+
+class VideoChatbot(Chatbot):
+    """
+    Chatbot over a video transcript, its answers cite the timestamps of the parts they use
+    """
+
+    qa_template = """
+        You are a helpful AI assistant named Robby. The user gives you the transcript of a video, its content is represented by the following pieces of the transcript, each one starting with its [start - end] timestamps. Use them to answer the question at the end.
+        Cite the timestamps of the pieces you use, like [12:34].
+        If you don't know the answer, just say you don't know. Do NOT try to make up an answer.
+        If the question is not related to the context, politely respond that you are tuned to only answer questions that are related to the context.
+        Use as much detail as possible when responding.
+
+        context: {context}
+        =========
+        question: {question}
+        ======
+        """
+
+    QA_PROMPT = PromptTemplate(template=qa_template, input_variables=["context","question" ])
 
 
 def count_tokens_chain(chain, query):
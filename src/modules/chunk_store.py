@@ -0,0 +1,173 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from langchain.embeddings.base import Embeddings
+
+class ChunkStore:
+    """
+    Persistent chunk hash -> embedding vector store shared by every document
+    """
+
+    # SQLite limits the number of bound parameters of a single statement
+    BATCH_SIZE = 500
+    # Rough size of a row besides its vector: hash, timestamp and SQLite bookkeeping
+    ROW_OVERHEAD_BYTES = 128
+    # Pruning goes this far below the bound so that it does not run on every insert
+    PRUNE_FRACTION = 0.1
+
+    _stores = {}
+    _stores_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, path, max_bytes=None):
+        """
+        Returns the store of a database file, shared by the whole process
+        so that its counters add up across documents and sessions
+        """
+        with cls._stores_lock:
+            if path not in cls._stores:
+                cls._stores[path] = cls(path, max_bytes)
+            return cls._stores[path]
+
+    def __init__(self, path, max_bytes=None):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        # Least recently used chunks are pruned past this size, None keeps them all
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (hash TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL DEFAULT 0)"
+        )
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(chunks)")]
+        if "last_used" not in columns:
+            # Stores created before chunks were pruned
+            self.connection.execute("ALTER TABLE chunks ADD COLUMN last_used REAL NOT NULL DEFAULT 0")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS chunks_last_used ON chunks (last_used)")
+        self.connection.commit()
+        self.hits = 0
+        self.misses = 0
+        self.hit_chars = 0
+        self.miss_chars = 0
+        self.embed_seconds = 0.0
+
+    @staticmethod
+    def hash_chunk(model, text):
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, hashes):
+        """
+        Returns the known vectors of the given chunk hashes, marking them as recently used
+        """
+        found = {}
+        hashes = list(set(hashes))
+        now = time.time()
+        with self.lock:
+            for start in range(0, len(hashes), self.BATCH_SIZE):
+                batch = hashes[start:start + self.BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.connection.execute(
+                    f"SELECT hash, vector FROM chunks WHERE hash IN ({placeholders})", batch
+                )
+                for chunk_hash, blob in rows:
+                    found[chunk_hash] = array("f", blob).tolist()
+            touched = list(found)
+            for start in range(0, len(touched), self.BATCH_SIZE):
+                batch = touched[start:start + self.BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                self.connection.execute(f"UPDATE chunks SET last_used = ? WHERE hash IN ({placeholders})", [now] + batch)
+            self.connection.commit()
+        return found
+
+    def put_many(self, items):
+        """
+        Stores (hash, vector) pairs as float32 blobs, then prunes the store back under max_bytes
+        """
+        now = time.time()
+        rows = [(chunk_hash, array("f", vector).tobytes(), now) for chunk_hash, vector in items]
+        if not rows:
+            return
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO chunks (hash, vector, last_used) VALUES (?, ?, ?)", rows)
+            self.prune(len(rows[0][1]))
+            self.connection.commit()
+
+    def prune(self, vector_bytes):
+        """
+        Deletes the least recently used chunks once the store holds more than max_bytes.
+        SQLite reuses the freed pages, so the file stops growing at about that size
+        """
+        if self.max_bytes is None:
+            return
+        max_rows = max(1, self.max_bytes // (vector_bytes + self.ROW_OVERHEAD_BYTES))
+        count = self.connection.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+        if count <= max_rows:
+            return
+        excess = count - int(max_rows * (1 - self.PRUNE_FRACTION))
+        self.connection.execute(
+            "DELETE FROM chunks WHERE hash IN (SELECT hash FROM chunks ORDER BY last_used LIMIT ?)", (excess,)
+        )
+
+    def record(self, hit_texts, miss_texts, embed_seconds):
+        with self.lock:
+            self.hits += len(hit_texts)
+            self.misses += len(miss_texts)
+            self.hit_chars += sum(len(text) for text in hit_texts)
+            self.miss_chars += sum(len(text) for text in miss_texts)
+            self.embed_seconds += embed_seconds
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and an estimate of what the hits saved
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            seconds_per_chunk = self.embed_seconds / self.misses if self.misses else 0.0
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                # ~4 characters per token for English text
+                "saved_tokens": self.hit_chars // 4,
+                "saved_seconds": seconds_per_chunk * self.hits,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings that only send the chunks missing from a ChunkStore to the wrapped model
+    """
+
+    def __init__(self, embeddings, store):
+        self.embeddings = embeddings
+        self.store = store
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+
+    def embed_documents(self, texts):
+        hashes = [self.store.hash_chunk(self.model, text) for text in texts]
+        known = self.store.get_many(hashes)
+
+        missing = {}
+        for chunk_hash, text in zip(hashes, texts):
+            if chunk_hash not in known and chunk_hash not in missing:
+                missing[chunk_hash] = text
+
+        start = time.perf_counter()
+        if missing:
+            new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            known.update(zip(missing.keys(), new_vectors))
+            self.store.put_many(zip(missing.keys(), new_vectors))
+        elapsed = time.perf_counter() - start
+
+        hit_texts = [text for chunk_hash, text in zip(hashes, texts) if chunk_hash not in missing]
+        self.store.record(hit_texts, list(missing.values()), elapsed)
+        return [known[chunk_hash] for chunk_hash in hashes]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
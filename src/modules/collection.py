@@ -0,0 +1,94 @@
+import hashlib
+import faiss
+import numpy as np
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.vectorstores import FAISS
+
+from modules.lexical import BM25Index
+
+
+def collection_key(doc_keys):
+    """
+    Identifies a set of documents, whatever the order they were uploaded in
+    """
+    return hashlib.sha256(":".join(sorted(doc_keys)).encode("utf-8")).hexdigest()
+
+
+def stored_vectors(index):
+    """
+    Returns every vector of a FAISS index, in position order
+    """
+    if isinstance(faiss.downcast_index(index), faiss.IndexIVF):
+        faiss.extract_index_ivf(index).make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+class DocumentCollection:
+    """
+    Several documents searched through one FAISS store. Documents are added to
+    and removed from the shared flat index incrementally. The store's doc_keys
+    array gives the document of each position, searches restricted to some
+    documents only look at their positions
+    """
+
+    def __init__(self):
+        self.vectors = None
+        self.names = {}
+
+    def _create(self, doc_vectors):
+        self.vectors = FAISS(doc_vectors.embedding_function, faiss.IndexFlatL2(doc_vectors.index.d), InMemoryDocstore({}), {})
+        self.vectors.lexical_index = BM25Index()
+        self.vectors.doc_keys = np.array([], dtype=object)
+
+    def add(self, doc_key, name, doc_vectors):
+        """
+        Appends the chunks of a document's vector store, reusing its embeddings
+        """
+        if doc_key in self.names:
+            return
+        if self.vectors is None:
+            self._create(doc_vectors)
+
+        embeddings = stored_vectors(doc_vectors.index)
+        text_embeddings, metadatas = [], []
+        for position in range(doc_vectors.index.ntotal):
+            doc = doc_vectors.docstore.search(doc_vectors.index_to_docstore_id[position])
+            text_embeddings.append((doc.page_content, embeddings[position]))
+            metadatas.append({**doc.metadata, "doc_key": doc_key, "source": name})
+
+        self.vectors.add_embeddings(text_embeddings, metadatas)
+        for text, _ in text_embeddings:
+            self.vectors.lexical_index.add(text)
+        self.vectors.doc_keys = np.concatenate([self.vectors.doc_keys, np.full(len(text_embeddings), doc_key, dtype=object)])
+        self.names[doc_key] = name
+
+    def remove(self, doc_key):
+        """
+        Drops the chunks of a document, the other documents are not re-embedded or re-indexed
+        """
+        if doc_key not in self.names:
+            return
+        docstore = self.vectors.docstore._dict
+        ordered_ids = [self.vectors.index_to_docstore_id[position] for position in range(len(self.vectors.index_to_docstore_id))]
+        removed = [position for position, doc_id in enumerate(ordered_ids) if docstore[doc_id].metadata["doc_key"] == doc_key]
+
+        # The flat index moves the following vectors up, the mapping follows
+        self.vectors.index.remove_ids(np.array(removed, dtype=np.int64))
+        self.vectors.lexical_index.remove(removed)
+        self.vectors.doc_keys = np.delete(self.vectors.doc_keys, removed)
+        removed_set = set(removed)
+        for position in removed:
+            del docstore[ordered_ids[position]]
+        kept_ids = [doc_id for position, doc_id in enumerate(ordered_ids) if position not in removed_set]
+        self.vectors.index_to_docstore_id.clear()
+        self.vectors.index_to_docstore_id.update(enumerate(kept_ids))
+        del self.names[doc_key]
+
+    def sync(self, documents):
+        """
+        Makes the collection hold exactly the given {doc_key: (name, vectors)} documents
+        """
+        for doc_key in [doc_key for doc_key in self.names if doc_key not in documents]:
+            self.remove(doc_key)
+        for doc_key, (name, doc_vectors) in documents.items():
+            self.add(doc_key, name, doc_vectors)
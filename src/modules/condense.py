@@ -0,0 +1,33 @@
+import re
+
+# How follow-up questions are rewritten into standalone questions
+CONDENSE_STRATEGIES = {
+    "skip": "Skip for self-contained questions",
+    "always": "Always condense",
+    "cheap": "Condense with a cheaper model",
+    "speculative": "Condense while retrieving on the raw question",
+}
+DEFAULT_CONDENSE_STRATEGY = "skip"
+# Model used by the "cheap" strategy
+CONDENSE_MODEL = "gpt-3.5-turbo"
+
+# Words that usually point back at an earlier turn
+REFERRING_WORDS = {
+    "it", "its", "they", "them", "their", "theirs", "this", "that", "these", "those",
+    "he", "him", "his", "she", "her", "hers", "there", "above", "previous", "earlier",
+    "same", "more", "else", "again", "other", "another", "former", "latter", "one", "ones",
+}
+CONTINUATION_WORDS = {"and", "but", "so", "then", "also", "or", "what's", "how's"}
+MIN_SELF_CONTAINED_WORDS = 4
+
+
+def is_self_contained(question):
+    """
+    Cheap local check for questions that can be answered without the chat history.
+    Short questions, questions opening like a continuation and questions using
+    a word that refers back to an earlier turn are considered follow-ups
+    """
+    words = re.findall(r"[\w']+", question.lower())
+    if len(words) < MIN_SELF_CONTAINED_WORDS or words[0] in CONTINUATION_WORDS:
+        return False
+    return not any(word in REFERRING_WORDS for word in words)
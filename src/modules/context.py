@@ -0,0 +1,125 @@
+import re
+import math
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.schema import BaseRetriever
+
+from modules.lexical import hybrid_search, vector_search
+from modules.tokens import count_tokens, count_tokens_cached
+
+# Context window of each model offered in the sidebar
+MODEL_CONTEXT_TOKENS = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-4": 8192,
+}
+DEFAULT_CONTEXT_TOKENS = 4096
+# Room left for the answer
+ANSWER_TOKENS = 1024
+
+
+def shingles(text, size=5):
+    words = re.findall(r"\w+", text.lower())
+    return {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+class ContextPacker:
+    """
+    Fills a model's prompt budget with the most relevant chunks, skipping
+    chunks that mostly repeat one already selected
+    """
+
+    def __init__(self, model_name, fetch_k=20, max_distance_ratio=1.25, duplicate_threshold=0.8):
+        self.model_name = model_name
+        self.fetch_k = fetch_k
+        # Chunks much further from the question than the best one are left out, so
+        # small questions get a small prompt even when the window could hold more
+        self.max_distance_ratio = max_distance_ratio
+        self.duplicate_threshold = duplicate_threshold
+
+    def budget(self, prompt_tokens):
+        """
+        Returns how many tokens of context fit next to a prompt of prompt_tokens tokens
+        """
+        window = MODEL_CONTEXT_TOKENS.get(self.model_name, DEFAULT_CONTEXT_TOKENS)
+        return max(0, window - ANSWER_TOKENS - prompt_tokens)
+
+    def is_duplicate(self, candidate, selected):
+        for other in selected:
+            overlap = len(candidate & other) / max(1, min(len(candidate), len(other)))
+            if overlap >= self.duplicate_threshold:
+                return True
+        return False
+
+    def within_distance(self, scored_docs):
+        """
+        Drops the chunks much further from the question than the best one. A distance
+        of None marks a chunk kept whatever its distance, like exact lexical matches
+        """
+        distances = [distance for _, distance in scored_docs if distance is not None and distance < math.inf]
+        if not distances:
+            return list(scored_docs)
+        best = min(distances)
+        # A best distance of 0 gives no scale, only chunks without a distance are dropped then
+        limit = best * self.max_distance_ratio if best > 0 else max(distances)
+        return [(doc, distance) for doc, distance in scored_docs if distance is None or distance <= limit]
+
+    def pack(self, scored_docs, budget):
+        """
+        Returns the documents to use, best first, and the tokens they take.
+        scored_docs are (document, distance) pairs, best first
+        """
+        packed, selected_shingles, used = [], [], 0
+        for doc, distance in self.within_distance(scored_docs):
+            tokens = count_tokens_cached(doc.page_content, self.model_name)
+            if used + tokens > budget:
+                continue
+            doc_shingles = shingles(doc.page_content)
+            if self.is_duplicate(doc_shingles, selected_shingles):
+                continue
+            selected_shingles.append(doc_shingles)
+            packed.append(Document(page_content=doc.page_content, metadata={**doc.metadata, "tokens": tokens}))
+            used += tokens
+        return packed, used
+
+
+class PackedRetriever(BaseRetriever):
+    """
+    Retriever handing the chain a token-budgeted, de-duplicated context
+    """
+
+    def __init__(self, vectors, packer, prompt_template):
+        self.vectors = vectors
+        self.packer = packer
+        # doc_keys of the documents to search, None searches all of them. Only
+        # stores with a doc_keys array, like a DocumentCollection's, can be filtered
+        self.doc_filter = None
+        self.template_tokens = count_tokens(prompt_template, packer.model_name)
+
+    def filtered_positions(self):
+        """
+        Returns the set of positions of the chunks of the documents in doc_filter
+        """
+        if self.doc_filter is None:
+            return None
+        return set(np.flatnonzero(np.isin(self.vectors.doc_keys, list(self.doc_filter))).tolist())
+
+    def get_relevant_documents(self, query):
+        fetch_k = self.packer.fetch_k
+        positions = self.filtered_positions()
+        if getattr(self.vectors, "lexical_index", None) is not None:
+            # Exact matches on codes and IDs that dense search tends to miss
+            scored_docs = hybrid_search(self.vectors, query, k=fetch_k, positions=positions)
+        elif positions is not None:
+            embedding = np.array([self.vectors.embedding_function(query)], dtype=np.float32)
+            scored_docs = [
+                (self.vectors.docstore.search(self.vectors.index_to_docstore_id[position]), distance)
+                for position, distance in vector_search(self.vectors, embedding, fetch_k, positions)
+            ]
+        else:
+            scored_docs = self.vectors.similarity_search_with_score(query, k=fetch_k)
+        budget = self.packer.budget(self.template_tokens + count_tokens(query, self.packer.model_name))
+        docs, _ = self.packer.pack(scored_docs, budget)
+        return docs
+
+    async def aget_relevant_documents(self, query):
+        return self.get_relevant_documents(query)
@@ -0,0 +1,45 @@
+import os
+
+
+def touch(path):
+    """
+    Marks a cache file as recently used
+    """
+    os.utime(path, None)
+
+
+def entry_key(filename):
+    """
+    Returns the cache entry a file belongs to, files sharing the
+    part of their name before the first dot are evicted together
+    """
+    return filename.split(".", 1)[0]
+
+
+def evict_lru(directory, max_bytes, keep=()):
+    """
+    Deletes the least recently used cache entries of a directory until
+    its total size fits in max_bytes. Entries listed in keep are never deleted
+    """
+    entries = {}
+    for filename in os.listdir(directory):
+        path = os.path.join(directory, filename)
+        if filename.startswith(".") or not os.path.isfile(path):
+            continue
+        stat = os.stat(path)
+        size, last_used, paths = entries.get(entry_key(filename), (0, 0.0, []))
+        entries[entry_key(filename)] = (size + stat.st_size, max(last_used, stat.st_mtime), paths + [path])
+
+    total = sum(size for size, _, _ in entries.values())
+    for key, (size, _, paths) in sorted(entries.items(), key=lambda item: item[1][1]):
+        if total <= max_bytes:
+            break
+        if key in keep:
+            continue
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        total -= size
+    return total
@@ -1,18 +1,47 @@
 import os
-import pickle
-import tempfile
-from langchain.document_loaders.csv_loader import CSVLoader
+import hashlib
 from langchain.vectorstores import FAISS
 from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.document_loaders import PyPDFLoader
 from langchain.document_loaders import TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
+from modules.disk_cache import evict_lru, touch
+from modules.chunk_store import ChunkStore, CachedEmbeddings
+from modules.embedding_pipeline import EmbeddingPipeline
+from modules.indexing import check_compression, optimize_index
+from modules.lexical import BM25Index
+from modules.loaders import cache_pages, extract_pdf_pages, iter_csv_documents, read_cached_pages, split_pages
+from modules.uploads import hash_file, spill
+from modules.vector_io import load_vectors, save_vectors, vectors_exist, INDEX_SUFFIX
+
+def count_progress(items, progress, counter):
+    for item in items:
+        yield item
+        progress(counter, 1)
+
+
 class Embedder:
 
+    CHUNK_SIZE = 2000
+    CHUNK_OVERLAP = 100
+    # CSV rows are packed into embedding units of up to this many tokens
+    CSV_UNIT_TOKENS = 500
+    CSV_ROWS_PER_READ = 5000
+    EMBED_BATCH_SIZE = 128
+    # Large corpora get an approximate index, optionally compressed with "fp16" or "pq"
+    INDEX_COMPRESSION = check_compression(os.environ.get("ROBBY_INDEX_COMPRESSION") or None)
+    EMBED_WORKERS = 4
+    # Upper bound for the embeddings directory, least recently used documents are evicted first
+    MAX_CACHE_BYTES = int(os.environ.get("ROBBY_EMBEDDINGS_CACHE_MB", "1024")) * 1024 * 1024
+    MAX_PAGES_CACHE_BYTES = MAX_CACHE_BYTES // 4
+    MAX_UPLOADS_CACHE_BYTES = MAX_CACHE_BYTES // 2
+    # Upper bound for the chunk vectors shared by every document
+    MAX_CHUNKS_CACHE_BYTES = int(os.environ.get("ROBBY_CHUNKS_CACHE_MB", "256")) * 1024 * 1024
+
     def __init__(self):
         self.PATH = "embeddings"
         self.createEmbeddingsDir()
+        self.chunk_store = ChunkStore.get(f"{self.PATH}/chunks/chunks.sqlite", self.MAX_CHUNKS_CACHE_BYTES)
 
     def createEmbeddingsDir(self):
         """
@@ -21,58 +50,173 @@ class Embedder:
         if not os.path.exists(self.PATH):
             os.mkdir(self.PATH)
 
-    def storeDocEmbeds(self, file, original_filename):
+    def get_file_extension(self, original_filename):
+        return os.path.splitext(original_filename)[1].lower()
+
+    def getContentHash(self, file_path):
+        return hash_file(file_path)
+
+    def storeUpload(self, file, original_filename):
         """
-        Stores document embeddings using Langchain and FAISS
+        Writes an uploaded file to the uploads directory once, the document is read
+        from there afterwards. Returns its (content hash, path)
+        """
+        uploads_dir = f"{self.PATH}/uploads"
+        content_hash, file_path = spill(file, uploads_dir, self.get_file_extension(original_filename))
+        evict_lru(uploads_dir, self.MAX_UPLOADS_CACHE_BYTES, keep=(content_hash,))
+        return content_hash, file_path
+
+    def getCacheKey(self, content_hash, original_filename):
+        """
+        Returns the cache key of a document, a hash of its content and of
+        everything that changes how it is chunked
+        """
+        params = f"{self.get_file_extension(original_filename)}:{self.CHUNK_SIZE}:{self.CHUNK_OVERLAP}:{self.CSV_UNIT_TOKENS}:{self.INDEX_COMPRESSION}"
+        return hashlib.sha256(f"{content_hash}:{params}".encode("utf-8")).hexdigest()
+
+    def getVideoCacheKey(self, video_id, window_seconds):
         """
-        with tempfile.NamedTemporaryFile(mode="wb", delete=False) as tmp_file:
-            tmp_file.write(file)
-            tmp_file_path = tmp_file.name
-            
-        def get_file_extension(uploaded_file):
-            file_extension =  os.path.splitext(uploaded_file)[1].lower()
-            
-            return file_extension
-        
+        Returns the cache key of a video transcript chunked in windows of window_seconds
+        """
+        return hashlib.sha256(f"youtube:{video_id}:{window_seconds}:{self.INDEX_COMPRESSION}".encode("utf-8")).hexdigest()
+
+    def getCachePath(self, cache_key):
+        return f"{self.PATH}/{cache_key}"
+
+    def getPagesCachePath(self, content_hash):
+        return f"{self.PATH}/pages/{content_hash}.jsonl"
+
+    def getCachedPdfPages(self, content_hash):
+        """
+        Returns the (page number, text) pairs of a PDF already extracted, None otherwise
+        """
+        cache_path = self.getPagesCachePath(content_hash)
+        if not os.path.isfile(cache_path):
+            return None
+        touch(cache_path)
+        return read_cached_pages(cache_path)
+
+    def getPdfPages(self, file_path, content_hash=None):
+        """
+        Yields the (page number, text) of a PDF. Each content is only extracted once,
+        by the ingestion job, the preview reads the extracted pages from disk
+        """
+        content_hash = content_hash or self.getContentHash(file_path)
+        cached_pages = self.getCachedPdfPages(content_hash)
+        if cached_pages is not None:
+            yield from cached_pages
+            return
+
+        pages_dir = f"{self.PATH}/pages"
+        cache_path = self.getPagesCachePath(content_hash)
+        os.makedirs(pages_dir, exist_ok=True)
+        yield from cache_pages(extract_pdf_pages(file_path), cache_path)
+        evict_lru(pages_dir, self.MAX_PAGES_CACHE_BYTES, keep=(content_hash,))
+
+    def storeDocEmbeds(self, file_path, original_filename, content_hash=None, cache_key=None, progress=None):
+        """
+        Stores document embeddings using Langchain and FAISS.
+        progress(counter, count) is told about the pages parsed and chunks embedded
+        """
+        content_hash = content_hash or self.getContentHash(file_path)
+        cache_key = cache_key or self.getCacheKey(content_hash, original_filename)
+
         text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size = 2000,
-                chunk_overlap  = 100,
+                chunk_size = self.CHUNK_SIZE,
+                chunk_overlap  = self.CHUNK_OVERLAP,
                 length_function = len,
             )
-        
-        file_extension = get_file_extension(original_filename)
+
+        file_extension = self.get_file_extension(original_filename)
 
         if file_extension == ".csv":
-            loader = CSVLoader(file_path=tmp_file_path, encoding="utf-8",csv_args={
-                'delimiter': ',',})
-            data = loader.load()
+            data = iter_csv_documents(file_path, original_filename, self.CSV_UNIT_TOKENS, self.CSV_ROWS_PER_READ)
 
         elif file_extension == ".pdf":
-            loader = PyPDFLoader(file_path=tmp_file_path)  
-            data = loader.load_and_split(text_splitter)
-        
+            # Chunks are streamed to the embedder while later pages are still being extracted
+            pages = self.getPdfPages(file_path, content_hash)
+            if progress is not None:
+                pages = count_progress(pages, progress, "pages")
+            data = split_pages(pages, text_splitter, original_filename)
+
         elif file_extension == ".txt":
-            loader = TextLoader(file_path=tmp_file_path, encoding="utf-8")
+            loader = TextLoader(file_path=file_path, encoding="utf-8")
             data = loader.load_and_split(text_splitter)
-            
-        embeddings = OpenAIEmbeddings()
 
-        vectors = FAISS.from_documents(data, embeddings)
-        os.remove(tmp_file_path)
+        self.storeDocuments(data, cache_key, progress)
+
+    def storeDocuments(self, documents, cache_key, progress=None):
+        """
+        Embeds already split documents and stores them under cache_key
+        """
+        # Retries are handled by the ingestion pipeline, one attempt per request here
+        embeddings = OpenAIEmbeddings(max_retries=1)
+
+        vectors = self.embedDocuments(documents, embeddings, progress=progress)
+        # Flat for small documents, HNSW or IVF once brute force search gets slow
+        vectors = optimize_index(vectors, self.INDEX_COMPRESSION)
+
+        # Save the raw FAISS index and its docstore
+        save_vectors(vectors, self.getCachePath(cache_key))
 
-        # Save the vectors to a pickle file
-        with open(f"{self.PATH}/{original_filename}.pkl", "wb") as f:
-            pickle.dump(vectors, f)
+        evict_lru(self.PATH, self.MAX_CACHE_BYTES, keep=(cache_key,))
 
-    def getDocEmbeds(self, file, original_filename):
+    def embedDocuments(self, documents, embeddings, embed_fn=None, progress=None):
         """
-        Retrieves document embeddings
+        Embeds documents batch by batch and adds them to a FAISS index and a BM25 index as they come.
+        embed_fn defaults to the chunk cache in front of embeddings, only the chunks
+        never seen in any previous document are sent to OpenAI
         """
-        if not os.path.isfile(f"{self.PATH}/{original_filename}.pkl"):
-            self.storeDocEmbeds(file, original_filename)
+        embed_fn = embed_fn or CachedEmbeddings(embeddings, self.chunk_store).embed_documents
+        # Rate limits apply per API key, hashed so that the key itself is not kept around
+        api_key = getattr(embeddings, "openai_api_key", None) or ""
+        limit_key = hashlib.sha256(api_key.encode()).hexdigest()
+        pipeline = EmbeddingPipeline(embed_fn, batch_size=self.EMBED_BATCH_SIZE,
+                                     max_workers=self.EMBED_WORKERS, limit_key=limit_key)
+
+        vectors = None
+        # Built alongside the vectors, chunk positions match the FAISS index
+        lexical_index = BM25Index()
+        for batch, batch_vectors in pipeline.run(documents):
+            text_embeddings = [(doc.page_content, vector) for doc, vector in zip(batch, batch_vectors)]
+            metadatas = [doc.metadata for doc in batch]
+            if vectors is None:
+                vectors = FAISS.from_embeddings(text_embeddings, embeddings, metadatas)
+            else:
+                vectors.add_embeddings(text_embeddings, metadatas)
+            for doc in batch:
+                lexical_index.add(doc.page_content)
+            if progress is not None:
+                progress("chunks", len(batch))
 
-        # Load the vectors from the pickle file
-        with open(f"{self.PATH}/{original_filename}.pkl", "rb") as f:
-            vectors = pickle.load(f)
-        
+        if vectors is None:
+            raise ValueError("No text could be extracted from the document")
+        vectors.lexical_index = lexical_index
         return vectors
+
+    def getDocEmbeds(self, file_path, original_filename, content_hash=None, progress=None):
+        """
+        Retrieves document embeddings, the same content is only embedded once
+        whatever the name it is uploaded under
+        """
+        content_hash = content_hash or self.getContentHash(file_path)
+        cache_key = self.getCacheKey(content_hash, original_filename)
+        cache_path = self.getCachePath(cache_key)
+        if vectors_exist(cache_path):
+            touch(cache_path + INDEX_SUFFIX)
+        else:
+            self.storeDocEmbeds(file_path, original_filename, content_hash, cache_key, progress)
+
+        # Load the vectors, the index is memory-mapped
+        return load_vectors(cache_path, OpenAIEmbeddings())
+
+    def getDocumentsEmbeds(self, documents, cache_key, progress=None):
+        """
+        Retrieves the embeddings of already split documents, embedding them the first time
+        """
+        cache_path = self.getCachePath(cache_key)
+        if vectors_exist(cache_path):
+            touch(cache_path + INDEX_SUFFIX)
+        else:
+            self.storeDocuments(documents, cache_key, progress)
+        return load_vectors(cache_path, OpenAIEmbeddings())
@@ -0,0 +1,149 @@
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import openai
+
+# Errors worth retrying, anything else (bad key, invalid input) fails the upload at once
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.APIError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+)
+
+
+def is_retryable(error):
+    return isinstance(error, RETRYABLE_ERRORS) or getattr(error, "http_status", None) == 429
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, refilled continuously at rate tokens per second
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """
+        Takes amount tokens and blocks until the bucket is out of debt.
+        A request larger than the capacity is charged in full, so it
+        delays the next ones instead of slipping past the limit
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """
+    Requests and tokens per minute budget of one API key
+    """
+
+    _limiters = {}
+    _limiters_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, key, requests_per_minute=3000, tokens_per_minute=1000000):
+        """
+        Returns the limiter of an API key, shared by the whole process so that
+        concurrent ingestion jobs split the per-minute budget instead of each getting all of it
+        """
+        with cls._limiters_lock:
+            if key not in cls._limiters:
+                cls._limiters[key] = cls(requests_per_minute, tokens_per_minute)
+            return cls._limiters[key]
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests = TokenBucket(requests_per_minute / 60, max(1, requests_per_minute // 60))
+        self.tokens = TokenBucket(tokens_per_minute / 60, max(1, tokens_per_minute // 60))
+
+    def acquire(self, tokens):
+        self.requests.acquire()
+        self.tokens.acquire(tokens)
+
+
+class EmbeddingPipeline:
+    """
+    Embeds documents in batches over a bounded thread pool, rate limited on
+    requests and tokens per minute and retried with exponential backoff.
+    embed_fn takes a list of texts and returns their vectors, so any
+    Embeddings.embed_documents (or a local fake) can be plugged in
+    """
+
+    def __init__(self, embed_fn, batch_size=128, max_workers=4, requests_per_minute=3000,
+                 tokens_per_minute=1000000, max_retries=6, backoff=1.0, max_backoff=60.0, limit_key=None):
+        self.embed_fn = embed_fn
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        # Pipelines of the same API key share one budget
+        self.limiter = RateLimiter.get(limit_key, requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retries = 0
+
+    @staticmethod
+    def estimate_tokens(texts):
+        # ~4 characters per token, only used for rate limiting
+        return sum(len(text) for text in texts) // 4 + 1
+
+    def embed_batch(self, texts):
+        """
+        Embeds one batch, retrying transient errors with jittered exponential backoff
+        """
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(self.estimate_tokens(texts))
+            try:
+                return self.embed_fn(texts)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                self.retries += 1
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+
+    def batches(self, documents):
+        batch = []
+        for doc in documents:
+            batch.append(doc)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def run(self, documents):
+        """
+        Embeds an iterable of documents, yielding (documents, vectors) batches in
+        input order as soon as they are ready. At most two batches per worker are
+        in flight, so documents can be a lazy generator of any length
+        """
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                for batch in self.batches(documents):
+                    texts = [doc.page_content for doc in batch]
+                    in_flight.append((batch, executor.submit(self.embed_batch, texts)))
+                    if len(in_flight) >= self.max_workers * 2:
+                        batch, future = in_flight.popleft()
+                        yield batch, future.result()
+                while in_flight:
+                    batch, future = in_flight.popleft()
+                    yield batch, future.result()
+            finally:
+                # Don't send the remaining batches if the upload failed or was abandoned
+                for _, future in in_flight:
+                    future.cancel()
@@ -2,11 +2,21 @@ import os
 import streamlit as st
 from streamlit_chat import message
 
+from modules.chat_render import ChatRenderer
+from modules.memory import ConversationMemory
+
 class ChatHistory:
     
-    def __init__(self):
-        self.history = st.session_state.get("history", [])
-        st.session_state["history"] = self.history
+    def __init__(self, namespace=None):
+        # Pages keeping their own conversation prefix their session state keys with a namespace
+        self.namespace = namespace
+        # Bounded history: recent turns plus a rolling summary of the older ones
+        if not isinstance(st.session_state.get(self.key("history")), ConversationMemory):
+            st.session_state[self.key("history")] = ConversationMemory()
+        self.history = st.session_state[self.key("history")]
+
+    def key(self, name):
+        return f"{self.namespace}_{name}" if self.namespace else name
 
     def default_greeting(self):
         return "Hey Robby ! 👋"
@@ -15,38 +25,48 @@ class ChatHistory:
         return f"Hello ! Ask me anything about {topic} 🤗"
 
     def initialize_user_history(self):
-        st.session_state["user"] = [self.default_greeting()]
+        st.session_state[self.key("user")] = [self.default_greeting()]
+
+    @staticmethod
+    def topic(uploaded_file):
+        if isinstance(uploaded_file, str):
+            return uploaded_file
+        if isinstance(uploaded_file, list):
+            return ", ".join(file.name for file in uploaded_file)
+        return uploaded_file.name
 
     def initialize_assistant_history(self, uploaded_file):
-        st.session_state["assistant"] = [self.default_prompt(uploaded_file.name)]
+        st.session_state[self.key("assistant")] = [self.default_prompt(self.topic(uploaded_file))]
 
     def initialize(self, uploaded_file):
-        if "assistant" not in st.session_state:
+        if self.key("assistant") not in st.session_state:
             self.initialize_assistant_history(uploaded_file)
-        if "user" not in st.session_state:
+        if self.key("user") not in st.session_state:
             self.initialize_user_history()
 
     def reset(self, uploaded_file):
-        st.session_state["history"] = []
+        st.session_state[self.key("history")] = ConversationMemory()
+        self.history = st.session_state[self.key("history")]
         
         self.initialize_user_history()
         self.initialize_assistant_history(uploaded_file)
         st.session_state["reset_chat"] = False
 
     def append(self, mode, message):
-        st.session_state[mode].append(message)
+        st.session_state[self.key(mode)].append(message)
 
     def generate_messages(self, container):
-        if st.session_state["assistant"]:
-            with container:
-                for i in range(len(st.session_state["assistant"])):
-                    message(
-                        st.session_state["user"][i],
-                        is_user=True,
-                        key=f"history_{i}_user",
-                        avatar_style="big-smile",
-                    )
-                    message(st.session_state["assistant"][i], key=str(i), avatar_style="thumbs")
+        users, assistants = st.session_state[self.key("user")], st.session_state[self.key("assistant")]
+        if assistants:
+
+            def draw_turn(i, user, assistant):
+                message(user, is_user=True, key=self.key(f"history_{i}_user"), avatar_style="big-smile")
+                message(assistant, key=self.key(str(i)), avatar_style="thumbs")
+
+            # Only the latest turns are drawn as messages, older ones are paged
+            ChatRenderer(self.key("chat")).render(
+                container, min(len(users), len(assistants)), lambda i: (users[i], assistants[i]), draw_turn
+            )
 
     def load(self):
         if os.path.exists(self.history_file):
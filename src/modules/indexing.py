@@ -0,0 +1,106 @@
+import math
+import faiss
+import numpy as np
+
+# Below this many vectors brute force search is fast enough and exact
+FLAT_MAX_VECTORS = 20000
+HNSW_NEIGHBORS = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+# Vectors used to train IVF centroids and PQ codebooks
+IVF_TRAINING_POINTS_PER_LIST = 64
+# Optional compression of the stored vectors: None, "fp16" (half the memory) or "pq" (~1/32)
+COMPRESSIONS = (None, "fp16", "pq")
+
+
+def check_compression(compression):
+    """
+    Returns compression if it is one of COMPRESSIONS, raises ValueError otherwise
+    """
+    if compression not in COMPRESSIONS:
+        valid = ", ".join(repr(option) for option in COMPRESSIONS if option is not None)
+        raise ValueError(f"Unknown index compression {compression!r}, expected one of {valid} or none")
+    return compression
+
+
+def choose_index_type(count, compression=None):
+    """
+    Returns the index type for a corpus: exact flat search for small corpora, HNSW for
+    large ones and IVF when the vectors are compressed, since IVF codes are compact
+    and its inverted lists can be memory-mapped
+    """
+    if count < FLAT_MAX_VECTORS:
+        return "flat"
+    return "hnsw" if compression is None else "ivf"
+
+
+def pq_subquantizers(dim):
+    # ~4 dimensions per one byte code, the count must divide the dimension
+    for m in range(max(1, dim // 4), 0, -1):
+        if dim % m == 0 and m <= 96:
+            return m
+    return 1
+
+
+def build_index(dim, count, compression=None):
+    """
+    Returns an empty (possibly untrained) FAISS index suited to count vectors
+    """
+    index_type = choose_index_type(count, check_compression(compression))
+    if index_type == "flat":
+        if compression is None:
+            return faiss.IndexFlatL2(dim)
+        # PQ codebooks need more vectors than a small corpus has, fp16 keeps recall exact enough
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16)
+
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, HNSW_NEIGHBORS)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+
+    nlist = int(4 * math.sqrt(count))
+    quantizer = faiss.IndexFlatL2(dim)
+    if compression == "pq":
+        index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_subquantizers(dim), 8)
+    else:
+        index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, faiss.ScalarQuantizer.QT_fp16)
+    index.nprobe = max(8, nlist // 32)
+    return index
+
+
+def train_and_add(index, vectors):
+    if not index.is_trained:
+        nlist = getattr(index, "nlist", 1)
+        sample_size = min(len(vectors), max(nlist * IVF_TRAINING_POINTS_PER_LIST, 10000))
+        sample = vectors[np.random.default_rng(0).choice(len(vectors), sample_size, replace=False)]
+        index.train(sample)
+    index.add(vectors)
+    return index
+
+
+def optimize_index(vectors, compression=None):
+    """
+    Replaces the flat index built during ingestion by the index suited to the
+    corpus size. Vector positions are unchanged so the docstore mapping still holds
+    """
+    count = vectors.index.ntotal
+    if choose_index_type(count, compression) == "flat" and compression is None:
+        return vectors
+    stored = vectors.index.reconstruct_n(0, count)
+    vectors.index = train_and_add(build_index(vectors.index.d, count, compression), stored)
+    return vectors
+
+
+def estimate_index_bytes(index):
+    """
+    Estimates the memory used by a FAISS index
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        links = index.ntotal * index.hnsw.nb_neighbors(0) * 4
+        return links + estimate_index_bytes(index.storage)
+    try:
+        return index.sa_code_size() * index.ntotal
+    except RuntimeError:
+        return index.ntotal * index.d * 4
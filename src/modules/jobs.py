@@ -0,0 +1,92 @@
+import os
+import time
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Job:
+    """
+    A background job and its progress counters, read by the sessions polling it
+    """
+
+    def __init__(self, key, description=""):
+        self.key = key
+        self.description = description
+        self.status = "queued"
+        self.progress = defaultdict(int)
+        self.result = None
+        self.error = None
+        self.finished_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.status in ("done", "failed")
+
+    def report(self, counter, count=1):
+        """
+        Adds count to a progress counter, e.g. report("pages", 8)
+        """
+        with self.lock:
+            self.progress[counter] += count
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.progress)
+
+
+class JobRegistry:
+    """
+    Runs jobs on a thread pool, off the Streamlit script thread. Jobs are keyed,
+    submitting a key that is queued, running or recently done returns the existing
+    job, so identical documents uploaded at the same time are only processed once
+    """
+
+    def __init__(self, max_workers=2, keep_seconds=600):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ingestion")
+        self.keep_seconds = keep_seconds
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key, fn, description=""):
+        """
+        Runs fn(job) in the background unless a job with the same key exists
+        """
+        with self.lock:
+            self._prune()
+            job = self.jobs.get(key)
+            if job is not None:
+                return job
+            job = self.jobs[key] = Job(key, description)
+        self.executor.submit(self._run, job, fn)
+        return job
+
+    def forget(self, key):
+        """
+        Drops a finished job, e.g. a failed one once its error was shown, so the key can be submitted again
+        """
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is not None and job.done:
+                del self.jobs[key]
+
+    def _run(self, job, fn):
+        job.status = "running"
+        try:
+            job.result = fn(job)
+            job.status = "done"
+        except Exception as e:
+            job.error = e
+            job.status = "failed"
+        finally:
+            job.finished_at = time.monotonic()
+
+    def _prune(self):
+        now = time.monotonic()
+        for key, job in list(self.jobs.items()):
+            if job.finished_at is not None and now - job.finished_at > self.keep_seconds:
+                del self.jobs[key]
+
+
+INGESTION_JOBS = JobRegistry(int(os.environ.get("ROBBY_INGESTION_WORKERS", "2")))
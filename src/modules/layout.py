@@ -42,3 +42,12 @@ class Layout:
             is_ready = submit_button and user_input
         return is_ready, user_input
     
+    def show_trace(self, steps):
+        """
+        Displays the steps recorded for the last answer
+        """
+        with st.expander("Display the agent's thoughts"):
+            if steps:
+                st.table([{key: value for key, value in step.items() if value is not None} for step in steps])
+            else:
+                st.write("No steps were recorded")
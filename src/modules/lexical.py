@@ -0,0 +1,159 @@
+import re
+import gzip
+import json
+import math
+from collections import Counter, defaultdict
+import faiss
+import numpy as np
+
+# Reciprocal rank fusion constant, as in the original RRF paper
+RRF_K = 60
+TOKEN_PATTERN = re.compile(r"\w+(?:[-_./]\w+)*")
+
+
+def tokenize(text):
+    """
+    Lowercased words. Codes and IDs such as "INV-2023-001" are kept whole
+    and also split into their parts
+    """
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(re.findall(r"\w+", token))
+    return tokens
+
+
+def identifier_terms(text):
+    """
+    Codes, IDs and numbers of a text, the terms an exact match on says more
+    than any vector distance. Common words are left out, most chunks share them
+    """
+    return {token for token in TOKEN_PATTERN.findall(text.lower()) if not token.isalpha()}
+
+
+class BM25Index:
+    """
+    Inverted BM25 index over the chunks of a vector store, chunk positions
+    are the same as in the FAISS index
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)
+        self.doc_lengths = []
+
+    def add(self, text):
+        position = len(self.doc_lengths)
+        tokens = tokenize(text)
+        for term, frequency in Counter(tokens).items():
+            self.postings[term][position] = frequency
+        self.doc_lengths.append(len(tokens))
+        return position
+
+    def search(self, query, k=20, positions=None):
+        """
+        Returns the (position, score) of the k best matching chunks,
+        among the given positions when there are some
+        """
+        count = len(self.doc_lengths)
+        if not count:
+            return []
+        average_length = sum(self.doc_lengths) / count
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, frequency in postings.items():
+                if positions is not None and position not in positions:
+                    continue
+                length_norm = 1 - self.b + self.b * self.doc_lengths[position] / average_length
+                scores[position] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def containing(self, terms):
+        """
+        Returns the positions of the chunks holding any of the terms
+        """
+        return {position for term in terms for position in self.postings.get(term, ())}
+
+    def remove(self, positions):
+        """
+        Removes chunks, the following chunks move up like in a flat FAISS index
+        """
+        removed = set(positions)
+        remap, doc_lengths = {}, []
+        for position, length in enumerate(self.doc_lengths):
+            if position not in removed:
+                remap[position] = len(doc_lengths)
+                doc_lengths.append(length)
+        for term in list(self.postings):
+            postings = {remap[position]: frequency for position, frequency in self.postings[term].items() if position in remap}
+            if postings:
+                self.postings[term] = postings
+            else:
+                del self.postings[term]
+        self.doc_lengths = doc_lengths
+
+    def save(self, path):
+        data = {"k1": self.k1, "b": self.b, "doc_lengths": self.doc_lengths, "postings": self.postings}
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump(data, f)
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(data["k1"], data["b"])
+        index.doc_lengths = data["doc_lengths"]
+        for term, postings in data["postings"].items():
+            index.postings[term] = {int(position): frequency for position, frequency in postings.items()}
+        return index
+
+
+def vector_search(vectors, embedding, k, positions=None):
+    """
+    Returns the (position, distance) of the k nearest vectors. Given positions, only
+    those are searched through a FAISS ID selector, however few of the vectors they are
+    """
+    if positions is None:
+        distances, found = vectors.index.search(embedding, k)
+    else:
+        selector = faiss.IDSelectorBatch(np.fromiter(positions, dtype=np.int64, count=len(positions)))
+        distances, found = vectors.index.search(embedding, k, params=faiss.SearchParameters(sel=selector))
+    return [(int(position), float(distance)) for position, distance in zip(found[0], distances[0]) if position != -1]
+
+
+def hybrid_search(vectors, query, k=20, positions=None):
+    """
+    Fuses the vector and BM25 results of a query with reciprocal rank fusion.
+    Returns (document, distance) pairs, best first. Distance is None for chunks
+    holding a code or ID of the query, their vector distance says little about
+    them. Chunks only BM25 found, on common words, get an infinite distance so
+    that the packer's distance cut-off leaves them out. positions, a set,
+    restricts the search to some chunks
+    """
+    embedding = np.array([vectors.embedding_function(query)], dtype=np.float32)
+    vector_hits = vector_search(vectors, embedding, k, positions)
+    lexical_hits = vectors.lexical_index.search(query, k, positions)
+
+    fused = defaultdict(float)
+    for rank, (position, _) in enumerate(vector_hits):
+        fused[position] += 1 / (RRF_K + rank + 1)
+    for rank, (position, _) in enumerate(lexical_hits):
+        fused[position] += 1 / (RRF_K + rank + 1)
+
+    distance_of = dict(vector_hits)
+    exact_matches = vectors.lexical_index.containing(identifier_terms(query))
+    results = []
+    for position, _ in sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]:
+        doc = vectors.docstore.search(vectors.index_to_docstore_id[position])
+        if position in exact_matches:
+            distance = None
+        else:
+            distance = distance_of.get(position, math.inf)
+        results.append((doc, distance))
+    return results
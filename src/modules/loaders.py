@@ -0,0 +1,124 @@
+import os
+import json
+import tempfile
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from pypdf import PdfReader
+from langchain.docstore.document import Document
+
+from modules.tokens import count_tokens
+
+# Below this many pages spawning worker processes costs more than it saves
+PARALLEL_MIN_PAGES = 16
+PAGES_PER_TASK = 8
+PDF_WORKERS = max(1, min(4, (os.cpu_count() or 1)))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Returns the process pool shared by every PDF extraction. Workers are
+    spawned rather than forked since the Streamlit server is multi-threaded
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def extract_page_range(path, start, stop):
+    reader = PdfReader(path)
+    return [(number, reader.pages[number].extract_text() or "") for number in range(start, stop)]
+
+
+def extract_pdf_pages(path):
+    """
+    Yields the (page number, text) of a PDF in page order, page ranges are
+    extracted in parallel and at most two ranges per worker are held in memory
+    """
+    page_count = len(PdfReader(path).pages)
+    if page_count < PARALLEL_MIN_PAGES:
+        yield from extract_page_range(path, 0, page_count)
+        return
+
+    pool = get_pool()
+    in_flight = deque()
+    for start in range(0, page_count, PAGES_PER_TASK):
+        in_flight.append(pool.submit(extract_page_range, path, start, min(start + PAGES_PER_TASK, page_count)))
+        if len(in_flight) >= PDF_WORKERS * 2:
+            yield from in_flight.popleft().result()
+    while in_flight:
+        yield from in_flight.popleft().result()
+
+
+def cache_pages(pages, cache_path):
+    """
+    Passes pages through while writing them to cache_path, the cache only
+    becomes visible once every page has been written. Each writer has its own
+    temporary file, sessions extracting the same PDF never write into each other's
+    """
+    tmp_file = tempfile.NamedTemporaryFile(
+        "w", encoding="utf-8", dir=os.path.dirname(cache_path) or ".", prefix=".", suffix=".tmp", delete=False
+    )
+    try:
+        with tmp_file as f:
+            for number, text in pages:
+                f.write(json.dumps([number, text]) + "\n")
+                yield number, text
+        os.replace(tmp_file.name, cache_path)
+    except BaseException:
+        # Failed, or the reader stopped early: the pages are incomplete
+        os.remove(tmp_file.name)
+        raise
+
+
+def read_cached_pages(cache_path):
+    with open(cache_path, "r", encoding="utf-8") as f:
+        for line in f:
+            number, text = json.loads(line)
+            yield number, text
+
+
+def split_pages(pages, text_splitter, source):
+    """
+    Yields the chunks of each page as soon as the page is available
+    """
+    for number, text in pages:
+        for chunk in text_splitter.split_text(text):
+            yield Document(page_content=chunk, metadata={"source": source, "page": number})
+
+
+def format_csv_row(columns, values):
+    # Same "column: value" layout as LangChain's CSVLoader
+    return "\n".join(f"{column.strip()}: {str(value).strip()}" for column, value in zip(columns, values))
+
+
+def iter_csv_documents(path, source, max_tokens, rows_per_read=5000):
+    """
+    Yields Documents packing consecutive CSV rows up to max_tokens each.
+    The file is read rows_per_read rows at a time so memory stays bounded
+    whatever its size
+    """
+    rows, tokens, first_row = [], 0, 0
+    reader = pd.read_csv(path, chunksize=rows_per_read, dtype=str, keep_default_na=False, encoding="utf-8")
+    with reader:
+        for frame in reader:
+            columns = [str(column) for column in frame.columns]
+            for row_number, values in zip(frame.index, frame.itertuples(index=False, name=None)):
+                text = format_csv_row(columns, values)
+                row_tokens = count_tokens(text) + 1
+                if rows and tokens + row_tokens > max_tokens:
+                    yield Document(page_content="\n\n".join(rows), metadata={"source": source, "row": first_row, "rows": len(rows)})
+                    rows, tokens = [], 0
+                if not rows:
+                    first_row = int(row_number)
+                rows.append(text)
+                tokens += row_tokens
+    if rows:
+        yield Document(page_content="\n\n".join(rows), metadata={"source": source, "row": first_row, "rows": len(rows)})
@@ -0,0 +1,114 @@
+import threading
+
+from modules.tokens import count_tokens, get_encoding
+
+
+def format_turns(turns):
+    return "\n".join(f"Human: {human}\nAssistant: {ai}" for human, ai in turns)
+
+
+class ConversationMemory:
+    """
+    Chat history kept within a token budget: a sliding window of the most recent
+    (question, answer) turns plus a rolling summary of the older ones. Turns leaving
+    the window are folded into the summary by a background thread, so the history
+    sent with each question stays the same size however long the conversation runs.
+    If summarizing keeps failing, the oldest pending turns are dropped so that the
+    history stays within twice max_tokens
+    """
+
+    def __init__(self, max_tokens=1000, window=4, summary_tokens=300):
+        self.max_tokens = max_tokens
+        self.window = window
+        self.summary_tokens = summary_tokens
+        self.summary = ""
+        self.turns = []
+        # Turns out of the window, waiting to be folded into the summary
+        self.pending = []
+        # Pending turns dropped unsummarized so far, lets a running summary tell which of its turns are left
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.summarizing = False
+
+    def __bool__(self):
+        with self.lock:
+            return bool(self.summary or self.pending or self.turns)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.pending) + len(self.turns)
+
+    @staticmethod
+    def _tokens(turns):
+        return sum(count_tokens(human) + count_tokens(ai) for human, ai in turns)
+
+    def append(self, turn):
+        """
+        Adds a (question, answer) turn, moving the turns that no longer fit out of the window.
+        Pending turns beyond the window's budget are dropped, oldest first
+        """
+        with self.lock:
+            self.turns.append(turn)
+            budget = self.max_tokens - self.summary_tokens
+            while len(self.turns) > 1 and (len(self.turns) > self.window or self._tokens(self.turns) > budget):
+                self.pending.append(self.turns.pop(0))
+            while self.pending and self._tokens(self.pending) > budget:
+                self.pending.pop(0)
+                self.dropped += 1
+
+    def summarize_in_background(self, summarize):
+        """
+        Folds the pending turns into the summary on a background thread.
+        summarize takes the current summary and the formatted turns and returns the new summary
+        """
+        with self.lock:
+            if self.summarizing or not self.pending:
+                return
+            self.summarizing = True
+        threading.Thread(target=self._summarize, args=(summarize,), daemon=True).start()
+
+    def _summarize(self, summarize):
+        try:
+            while True:
+                with self.lock:
+                    turns, summary, dropped = list(self.pending), self.summary, self.dropped
+                if not turns:
+                    return
+                new_summary = self.truncate(summarize(summary, format_turns(turns)).strip())
+                with self.lock:
+                    self.summary = new_summary
+                    # Turns dropped meanwhile were the oldest of those just summarized
+                    del self.pending[:max(0, len(turns) - (self.dropped - dropped))]
+        except Exception:
+            # The pending turns stay in the prompt and are retried after the next answer
+            pass
+        finally:
+            with self.lock:
+                self.summarizing = False
+
+    def truncate(self, summary):
+        encoding = get_encoding()
+        tokens = encoding.encode(summary, disallowed_special=())
+        if len(tokens) <= self.summary_tokens:
+            return summary
+        return encoding.decode(tokens[:self.summary_tokens])
+
+    def to_prompt(self):
+        """
+        Returns the history as sent to the question condensing prompt
+        """
+        with self.lock:
+            parts = []
+            if self.summary:
+                parts.append(f"Summary of the earlier conversation: {self.summary}")
+            # Turns still being summarized are kept until their summary is ready
+            if self.pending or self.turns:
+                parts.append(format_turns(self.pending + self.turns))
+            return "\n".join(parts)
+
+    def clear(self):
+        with self.lock:
+            self.summary = ""
+            self.turns = []
+            self.pending = []
+            self.dropped = 0
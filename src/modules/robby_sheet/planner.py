@@ -0,0 +1,288 @@
+import re
+import threading
+import pandas as pd
+
+AGGREGATIONS = {
+    "sum": "sum", "total": "sum",
+    "average": "mean", "mean": "mean", "avg": "mean",
+    "maximum": "max", "max": "max", "highest": "max", "largest": "max", "biggest": "max",
+    "minimum": "min", "min": "min", "lowest": "min", "smallest": "min",
+    "median": "median",
+}
+OPERATORS = {
+    ">=": "ge", "<=": "le", "!=": "ne", ">": "gt", "<": "lt", "=": "eq", "==": "eq",
+    "is greater than or equal to": "ge", "is less than or equal to": "le",
+    "is greater than": "gt", "is more than": "gt", "greater than": "gt", "more than": "gt", "above": "gt", "over": "gt",
+    "is less than": "lt", "less than": "lt", "below": "lt", "under": "lt",
+    "is not": "ne", "is": "eq", "equals": "eq", "equal to": "eq",
+}
+# Longest first so that "is greater than" wins over "is"
+OPERATOR_PATTERN = "|".join(re.escape(op) for op in sorted(OPERATORS, key=len, reverse=True))
+UNPARSED_CONDITION = re.compile(
+    r"[<>=]|\b(above|below|over|under|greater|less|more than|between|except|excluding|not|only|if|when|where|with|whose)\b"
+    # "for Widget" and "in the North region" restrict the rows too, "for each" groups them
+    r"|\bfor\b(?!\s+each\b)"
+    r"|\bin\b(?!\s+(?:the|this)\s+(?:table|file|sheet|spreadsheet|data|dataset|dataframe)\b)"
+)
+# "Which product has the highest price" asks for another column than the one aggregated
+ASKS_FOR_ROW = re.compile(r"^\s*(?:which|who|whom)\b|^\s*what\s+(?:\w+\s+){1,3}?(?:has|have|had|does|did)\b")
+MAX_ROWS_SHOWN = 50
+# Words that ask the question without saying anything about which rows or columns
+KNOWN_WORDS = set(AGGREGATIONS) | set("""
+    a an the of in is are was were there what whats s how many much number me show give tell list display get find
+    please can could you i do all this table file sheet spreadsheet data dataset dataframe
+    row rows record records line lines entry entries column columns names count value values
+    per by for each grouped top bottom first last unique distinct different
+""".split())
+# Plans whose question holds a number of rows
+ROW_SELECTIONS = ("first", "last", "top", "bottom")
+# A filter value with a second condition or a qualifier, taking it literally would be wrong
+COMPOUND_VALUE = re.compile(r",|;|\b(?:and|or|but|sorted|ordered)\b|(?:^|\s)(?:" + OPERATOR_PATTERN + r")(?:\s|$)", re.IGNORECASE)
+
+
+class Plan:
+    """
+    A question the planner understood: the columns it needs and how to compute the answer
+    """
+
+    def __init__(self, description, columns, compute, compute_table=None):
+        self.description = description
+        self.columns = columns
+        self.compute = compute
+        # For plans reading every column, computes the result from an Arrow table without loading all of it
+        self.compute_table = compute_table
+
+    def run(self, df):
+        return format_result(self.compute(df))
+
+    def run_table(self, table):
+        return format_result(self.compute_table(table))
+
+
+def format_result(result):
+    if isinstance(result, pd.DataFrame):
+        return result.head(MAX_ROWS_SHOWN).to_string()
+    if isinstance(result, pd.Series):
+        return result.head(MAX_ROWS_SHOWN).to_string()
+    if isinstance(result, float):
+        return f"{result:,.4f}".rstrip("0").rstrip(".")
+    return str(result)
+
+
+def find_columns(text, columns):
+    """
+    Returns the columns named in text, in order of appearance. Longer names are
+    matched first so that "unit price" is not read as "price"
+    """
+    found, taken = [], text.lower()
+    for column in sorted(columns, key=lambda c: len(str(c)), reverse=True):
+        name = str(column).lower()
+        match = re.search(r"(?<!\w)" + re.escape(name) + r"(?!\w)", taken)
+        if match:
+            found.append((match.start(), column))
+            # Blank the match out so shorter names inside it are not matched again
+            taken = taken[:match.start()] + " " * len(name) + taken[match.end():]
+    return [column for _, column in sorted(found, key=lambda item: item[0])]
+
+
+def unknown_words(question, used_columns, allow_numbers=False):
+    """
+    Returns the words of a question that are neither the names of the columns
+    the plan uses nor words the planner knows, like "Widget" in "sum of units of Widget"
+    """
+    text = question.lower()
+    for column in sorted(used_columns, key=lambda c: len(str(c)), reverse=True):
+        text = re.sub(r"(?<!\w)" + re.escape(str(column).lower()) + r"(?!\w)", " ", text)
+    return [
+        word for word in re.findall(r"\w+", text)
+        if word not in KNOWN_WORDS and not (allow_numbers and word.isdigit())
+    ]
+
+
+def apply_filter(df, column, operator, value):
+    """
+    Keeps the rows matching the condition. Raises ValueError when a number
+    column is compared with text, or when no text equals the value, which was then
+    likely misread. The question is left to PandasAI
+    """
+    series = df[column]
+    value = value.strip().strip("'\"")
+    if pd.api.types.is_numeric_dtype(series):
+        value = float(value)
+    else:
+        # Text comparisons ignore case, like people asking the question do
+        series, value = series.astype(str).str.lower(), value.lower()
+        if operator == "eq" and not (series == value).any():
+            raise ValueError(f"No {column} equals {value!r}")
+    return df[getattr(series, operator)(value)]
+
+
+class QueryPlanner:
+    """
+    Answers common questions about a table (row and column counts, sums, means,
+    group-bys, top-N and filters on named columns) with vectorized pandas instead of
+    an LLM round-trip. Questions it cannot match return None and go to PandasAI
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.fast_seconds = 0.0
+        self.fallback_seconds = 0.0
+
+    def split_filter(self, question, columns):
+        """
+        Returns the question without its "where <column> <operator> <value>" clause, and that clause
+        """
+        match = re.search(r"\b(?:where|with|for which|whose)\s+(.+?)\s+(" + OPERATOR_PATTERN + r")\s+(.+?)\s*\??$", question, re.IGNORECASE)
+        if not match:
+            return question, None
+        filter_columns = find_columns(match.group(1), columns)
+        if len(filter_columns) != 1 or COMPOUND_VALUE.search(match.group(3)):
+            # The clause stays in the question, which the planner then leaves to PandasAI
+            return question, None
+        condition = (filter_columns[0], OPERATORS[match.group(2).lower()], match.group(3))
+        return question[:match.start()].strip(), condition
+
+    def plan(self, question, columns, numeric=()):
+        """
+        Returns a Plan for the question, or None if it is not a question the planner knows.
+        numeric are the number columns, the only ones that are aggregated
+        """
+        question = question.strip()
+        question, condition = self.split_filter(question, columns)
+        plan = self.match(question.lower(), columns, set(numeric))
+        if plan is None or condition is None:
+            return plan
+
+        column, operator, value = condition
+        compute = plan.compute
+        return Plan(
+            f"{plan.description} where {column} {operator} {value}",
+            None if plan.columns is None else list(dict.fromkeys(plan.columns + [column])),
+            lambda df: compute(apply_filter(df, column, operator, value)),
+        )
+
+    def match(self, question, columns, numeric=frozenset()):
+        """
+        Returns a Plan when every word of the question is understood, a named column the
+        plan does not use or a word it does not know (like a value to filter on) means
+        the question says more than the plan computes
+        """
+        if UNPARSED_CONDITION.search(question) or ASKS_FOR_ROW.search(question):
+            # A condition the planner could not read, or a question about another column
+            # than the computed one, answering would be wrong
+            return None
+        named = find_columns(question, columns)
+        matched = self.match_plan(question, columns, numeric, named)
+        if matched is None:
+            return None
+        plan, used = matched
+        if set(named) - set(used):
+            return None
+        if unknown_words(question, used, allow_numbers=plan.description.split()[0] in ROW_SELECTIONS):
+            return None
+        return plan
+
+    def match_plan(self, question, columns, numeric, named):
+        """
+        Returns the plan of a question and the columns it uses
+        """
+        if re.search(r"\b(how many|number of|count)\b.*\b(rows|records|lines|entries)\b", question) and not re.search(r"\b(per|by|each)\b", question):
+            return Plan("row count", [], len), []
+        if re.search(r"\b(how many|number of|count)\b.*\bcolumns\b", question):
+            return Plan("column count", [], lambda df: len(columns)), []
+        if re.search(r"\b(list|what are|show|which are)\b.*\bcolumns\b", question):
+            return Plan("column names", [], lambda df: ", ".join(map(str, columns))), []
+
+        top = re.search(r"\b(top|bottom|first|last)\s+(\d+)\b", question)
+        if top and top.group(1) in ("first", "last"):
+            if re.search(r"\bby\b", question):
+                # "last 2 rows by price" could mean either end of either order
+                return None
+            n, first = int(top.group(2)), top.group(1) == "first"
+
+            def edge_rows(table):
+                # Slices of a memory-mapped table only read those rows, row numbers are kept as in df.tail
+                start = 0 if first else max(0, table.num_rows - n)
+                rows = table.slice(start, n).to_pandas()
+                rows.index += start
+                return rows
+
+            return Plan(f"{top.group(1)} {n} rows", None, lambda df: df.head(n) if first else df.tail(n), edge_rows), []
+        if not named:
+            return None
+
+        if top:
+            by = named[-1]
+            if by not in numeric:
+                return None
+            n = int(top.group(2))
+            ascending = top.group(1) == "bottom"
+
+            def top_rows(table):
+                # Only the sorted column is loaded, then the n rows are taken from the table
+                values = table.column(by).to_pandas()
+                rows = values.nsmallest(n) if ascending else values.nlargest(n)
+                return table.take(rows.index.to_numpy()).to_pandas().set_index(rows.index)
+
+            return Plan(
+                f"{top.group(1)} {n} by {by}", None,
+                lambda df: df.nsmallest(n, by) if ascending else df.nlargest(n, by),
+                top_rows,
+            ), [by]
+
+        if re.search(r"\b(unique|distinct|different)\b", question):
+            column = named[0]
+            if re.search(r"\b(how many|number of|count)\b", question):
+                return Plan(f"distinct count of {column}", [column], lambda df: df[column].nunique()), [column]
+            return Plan(f"distinct values of {column}", [column], lambda df: pd.Series(df[column].unique(), name=column)), [column]
+
+        group = re.search(r"\b(?:per|by|for each|each|grouped by)\s+(.+)$", question)
+        group_columns = find_columns(group.group(1), columns) if group else []
+        words = set(re.findall(r"\w+", question))
+        aggregation = next((AGGREGATIONS[word] for word in AGGREGATIONS if word in words), None)
+
+        if group_columns:
+            by = group_columns[0]
+            values = [column for column in named if column != by]
+            if aggregation and values:
+                column = values[0]
+                if column not in numeric:
+                    return None
+                return Plan(
+                    f"{aggregation} of {column} by {by}", [by, column],
+                    lambda df: df.groupby(by)[column].agg(aggregation).sort_values(ascending=False),
+                ), [by, column]
+            if re.search(r"\b(how many|number of|count)\b", question):
+                return Plan(f"row count by {by}", [by], lambda df: df[by].value_counts()), [by]
+            return None
+
+        if aggregation and named[0] in numeric:
+            column = named[0]
+            return Plan(f"{aggregation} of {column}", [column], lambda df: df[column].agg(aggregation)), [column]
+        return None
+
+    def record(self, fast, seconds):
+        with self.lock:
+            if fast:
+                self.hits += 1
+                self.fast_seconds += seconds
+            else:
+                self.misses += 1
+                self.fallback_seconds += seconds
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "fast_latency": self.fast_seconds / self.hits if self.hits else 0.0,
+                "fallback_latency": self.fallback_seconds / self.misses if self.misses else 0.0,
+            }
+
+
+QUERY_PLANNER = QueryPlanner()
@@ -0,0 +1,149 @@
+import os
+import re
+import tempfile
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+from modules.disk_cache import evict_lru, touch
+
+TABLE_SUFFIX = ".arrow"
+# Files this large are converted and queried in batches instead of being loaded into pandas
+LAZY_MIN_BYTES = int(os.environ.get("ROBBY_SHEET_LAZY_MB", "0")) * 1024 * 1024 or None
+# A parsed table takes several times the size of its CSV
+LAZY_MEMORY_FRACTION = 0.25
+LAZY_BLOCK_BYTES = 64 * 1024 * 1024
+PREVIEW_ROWS = 1000
+# pyarrow names the column whose type, inferred from the first block, a later value does not fit
+CONVERSION_ERROR = re.compile(r"In CSV column #(\d+): .*CSV conversion error to (\w+)")
+
+
+def physical_memory():
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def is_lazy(file_path):
+    """
+    Tells whether a file is too large to be loaded as a DataFrame
+    """
+    size = os.path.getsize(file_path)
+    if LAZY_MIN_BYTES is not None:
+        return size >= LAZY_MIN_BYTES
+    memory = physical_memory()
+    return memory is not None and size > memory * LAZY_MEMORY_FRACTION
+
+
+def to_arrow(df):
+    df.columns = [str(column) for column in df.columns]
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Spreadsheet columns mixing numbers and text are kept as text
+        for column in df.columns[df.dtypes == object]:
+            df[column] = df[column].astype("string")
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def write_batches(path, schema, batches):
+    # Uncompressed so that the file can be memory-mapped and read without copying
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        for batch in batches:
+            writer.write(batch)
+
+
+def widened_type(arrow_type):
+    # Integers that turn out to hold decimals become floats, anything else becomes text
+    return pa.float64() if pa.types.is_integer(arrow_type) else pa.string()
+
+
+def stream_csv(file_path, tmp_path):
+    """
+    Streams a CSV file block by block into tmp_path. Column types are inferred from
+    the first block, a column holding a later value that does not fit its type
+    (like "unknown" in a number column) is widened and the file streamed again
+    """
+    column_types = {}
+    while True:
+        reader = pa_csv.open_csv(
+            file_path,
+            read_options=pa_csv.ReadOptions(block_size=LAZY_BLOCK_BYTES),
+            convert_options=pa_csv.ConvertOptions(column_types=column_types),
+        )
+        try:
+            write_batches(tmp_path, reader.schema, reader)
+            return
+        except pa.ArrowInvalid as e:
+            match = CONVERSION_ERROR.search(str(e))
+            if match is None:
+                raise
+            field = reader.schema.field(int(match.group(1)))
+            if pa.types.is_string(field.type):
+                raise
+            column_types[field.name] = widened_type(field.type)
+
+
+def convert_table(file_path, table_path, is_excel=False):
+    """
+    Parses a CSV or Excel file once and writes it as an Arrow IPC file. Large CSV
+    files are streamed block by block instead of being loaded at once
+    """
+    # Each conversion has its own temporary file, sessions converting the same file never share one
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(table_path), prefix=".", suffix=".tmp", delete=False) as tmp_file:
+        tmp_path = tmp_file.name
+    try:
+        if not is_excel and is_lazy(file_path):
+            stream_csv(file_path, tmp_path)
+        else:
+            df = pd.read_excel(file_path) if is_excel else pd.read_csv(file_path)
+            table = to_arrow(df)
+            write_batches(tmp_path, table.schema, table.to_batches())
+        os.replace(tmp_path, table_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def open_table(table_path):
+    """
+    Returns the Arrow table of a converted file, memory-mapped: only the pages
+    actually read are loaded, so tables larger than RAM can be opened
+    """
+    return pa.ipc.open_file(pa.memory_map(table_path, "r")).read_all()
+
+
+class TableCache:
+    """
+    Parsed spreadsheets stored as Arrow files keyed by content hash, files are
+    parsed once and every later load is a memory map of the stored table
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def get_table(self, file_path, content_hash, is_excel=False):
+        table_path = os.path.join(self.directory, content_hash + TABLE_SUFFIX)
+        if os.path.isfile(table_path):
+            touch(table_path)
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            convert_table(file_path, table_path, is_excel)
+            evict_lru(self.directory, self.max_bytes, keep=(content_hash,))
+        return open_table(table_path)
+
+    def get_dataframe(self, file_path, content_hash, is_excel=False):
+        """
+        Returns (DataFrame, lazy). Lazy files only get their first PREVIEW_ROWS rows
+        as a DataFrame, queries on them should go through get_table
+        """
+        table = self.get_table(file_path, content_hash, is_excel)
+        if not is_excel and is_lazy(file_path):
+            return table.slice(0, PREVIEW_ROWS).to_pandas(), True
+        # Numeric columns without missing values are handed to pandas without a copy
+        return table.to_pandas(split_blocks=True), False
+
+
+TABLE_CACHE = TableCache("embeddings/tables", int(os.environ.get("ROBBY_TABLES_CACHE_MB", "512")) * 1024 * 1024)
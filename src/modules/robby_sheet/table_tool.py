@@ -1,7 +1,8 @@
-import re
-import sys
-from io import StringIO, BytesIO
+import time
+from io import BytesIO
 import matplotlib.pyplot as plt
+import pandas as pd
+import pyarrow as pa
 import streamlit as st
 from langchain.callbacks import get_openai_callback
 from streamlit_chat import message
@@ -9,6 +10,19 @@ from streamlit_chat import message
 from pandasai import PandasAI
 from pandasai.llm.openai import OpenAI
 
+from modules.callbacks import TraceHandler
+from modules.chat_render import ChatRenderer
+from modules.robby_sheet.planner import QUERY_PLANNER
+
+
+def is_numeric_type(arrow_type):
+    return pa.types.is_integer(arrow_type) or pa.types.is_floating(arrow_type) or pa.types.is_decimal(arrow_type)
+
+
+def is_numeric_column(series):
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+
 class PandasAgent :
 
     @staticmethod
@@ -25,13 +39,57 @@ class PandasAgent :
     def __init__(self):
         pass
 
-    def get_agent_response(self, uploaded_file_content, query):
+    def answer_locally(self, df, query, table=None):
+        """
+        Answers the query with pandas when the planner recognizes it, returns None otherwise.
+        table is the memory-mapped Arrow table of a file too large for df to hold all of it
+        """
+        if table is not None:
+            columns = table.column_names
+            numeric = [field.name for field in table.schema if is_numeric_type(field.type)]
+        else:
+            columns = list(df.columns)
+            numeric = [column for column in columns if is_numeric_column(df[column])]
+        plan = QUERY_PLANNER.plan(query, columns, numeric)
+        if plan is None:
+            return None
+        try:
+            if table is None:
+                return plan.run(df), plan
+            if plan.columns is None:
+                # Loading every column of a file this large is what lazy mode avoids
+                return (plan.run_table(table), plan) if plan.compute_table is not None else None
+            # Only the columns the plan reads are loaded from the memory-mapped table
+            df = table.select(plan.columns).to_pandas() if plan.columns else pd.DataFrame(index=pd.RangeIndex(table.num_rows))
+            return plan.run(df), plan
+        except (ValueError, TypeError, KeyError):
+            # e.g. a number column compared with text, PandasAI gets the question
+            return None
+
+    def get_agent_response(self, uploaded_file_content, query, table=None):
+        """
+        Returns the response and a TraceHandler holding the steps taken to get it
+        """
+        trace = TraceHandler()
+        start = time.perf_counter()
+        with trace.step("planner") as step:
+            local = self.answer_locally(uploaded_file_content, query, table)
+            step["plan"] = local[1].description if local is not None else "not understood"
+        if local is not None:
+            response, plan = local
+            QUERY_PLANNER.record(True, time.perf_counter() - start)
+            return response, trace
+
         llm = OpenAI()
-        pandas_ai = PandasAI(llm, verbose=True)
-        old_stdout = sys.stdout
-        sys.stdout = captured_output = StringIO()
-        
-        response = pandas_ai.run(data_frame = uploaded_file_content, prompt=query)
+        pandas_ai = PandasAI(llm, verbose=False)
+        # PandasAI calls OpenAI itself, its steps are read back from its last run
+        with trace.step("pandasai") as step:
+            try:
+                response = pandas_ai.run(data_frame = uploaded_file_content, prompt=query)
+            finally:
+                step["code"] = pandas_ai.last_run_code or pandas_ai.last_code_generated
+                if pandas_ai.last_error:
+                    step["error"] = pandas_ai.last_error
         fig = plt.gcf()
         if fig.get_axes():
                     # Adjust the figure size
@@ -43,27 +101,31 @@ class PandasAgent :
             fig.savefig(buf, format="png")
             buf.seek(0)
             st.image(buf, caption="Generated Plot")
-        
-        sys.stdout = old_stdout
-        return response, captured_output
 
-    def process_agent_thoughts(self,captured_output):
-        thoughts = captured_output.getvalue()
-        cleaned_thoughts = re.sub(r'\x1b\[[0-9;]*[a-zA-Z]', '', thoughts)
-        cleaned_thoughts = re.sub(r'\[1m>', '', cleaned_thoughts)
-        return cleaned_thoughts
+        QUERY_PLANNER.record(False, time.perf_counter() - start)
+        return response, trace
 
-    def display_agent_thoughts(self,cleaned_thoughts):
-        with st.expander("Display the agent's thoughts"):
-            st.write(cleaned_thoughts)
+    @staticmethod
+    def display_planner_stats():
+        stats = QUERY_PLANNER.stats()
+        st.caption(
+            f"Answered without the LLM: {stats['hit_rate']:.0%} of {stats['hits'] + stats['misses']} questions "
+            f"({stats['fast_latency'] * 1000:.0f} ms on average, {stats['fallback_latency']:.1f}s through PandasAI)"
+        )
 
     def update_chat_history(self,query, result):
         st.session_state.chat_history.append(("user", query))
         st.session_state.chat_history.append(("agent", result))
 
     def display_chat_history(self):
-        for i, (sender, message_text) in enumerate(st.session_state.chat_history):
-            if sender == "user":
-                message(message_text, is_user=True, key=f"{i}_user")
-            else:
-                message(message_text, key=f"{i}")
\ No newline at end of file
+        chat_history = st.session_state.chat_history
+
+        def draw_turn(i, query, result):
+            message(query, is_user=True, key=f"{2 * i}_user")
+            message(result, key=f"{2 * i + 1}")
+
+        # Messages alternate between the user and the agent, only the latest turns are drawn as messages
+        ChatRenderer("sheet_chat").render(
+            st.container(), len(chat_history) // 2,
+            lambda i: (chat_history[2 * i][1], chat_history[2 * i + 1][1]), draw_turn,
+        )
\ No newline at end of file
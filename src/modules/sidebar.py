@@ -1,5 +1,7 @@
 import streamlit as st
 
+from modules.condense import CONDENSE_STRATEGIES, DEFAULT_CONDENSE_STRATEGY
+
 class Sidebar:
 
     MODEL_OPTIONS = ["gpt-3.5-turbo", "gpt-4"]
@@ -39,13 +41,35 @@ class Sidebar:
             step=self.TEMPERATURE_STEP,
         )
         st.session_state["temperature"] = temperature
-        
+
+    def condense_strategy_selector(self):
+        strategies = list(CONDENSE_STRATEGIES)
+        strategy = st.selectbox(
+            label="Follow-up questions",
+            options=strategies,
+            index=strategies.index(DEFAULT_CONDENSE_STRATEGY),
+            format_func=CONDENSE_STRATEGIES.get,
+        )
+        st.session_state["condense_strategy"] = strategy
+
+    @staticmethod
+    def document_filter(names):
+        """
+        Lets the user restrict the search to some of the uploaded documents
+        """
+        if len(names) < 2:
+            return names
+        selected = st.sidebar.multiselect("Search in", options=names, default=names)
+        # Searching nothing makes no sense, fall back to every document
+        return selected or names
+
     def show_options(self):
         with st.sidebar.expander("🛠️ Robby's Tools", expanded=False):
 
             self.reset_chat_button()
             self.model_selector()
             self.temperature_slider()
+            self.condense_strategy_selector()
             st.session_state.setdefault("model", self.MODEL_OPTIONS[0])
             st.session_state.setdefault("temperature", self.TEMPERATURE_DEFAULT_VALUE)
 
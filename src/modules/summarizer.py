@@ -0,0 +1,112 @@
+import asyncio
+from langchain.chains import LLMChain
+from langchain.chains.summarize.map_reduce_prompt import PROMPT
+from langchain.llms import OpenAI
+
+from modules.tokens import count_tokens, get_encoding
+
+# text-davinci-003 has 4097 tokens for the prompt and the 256 token summary
+CHUNK_TOKENS = 3000
+MAX_CONCURRENCY = 8
+
+
+def split_long_text(text, max_tokens, model):
+    encoding = get_encoding(model)
+    tokens = encoding.encode(text, disallowed_special=())
+    return [encoding.decode(tokens[start:start + max_tokens]) for start in range(0, len(tokens), max_tokens)]
+
+
+def pack_by_tokens(texts, max_tokens, model=None):
+    """
+    Joins consecutive texts into chunks of at most max_tokens tokens,
+    a text longer than that on its own is cut at token boundaries
+    """
+    chunks, current, current_tokens = [], [], 0
+    for text in texts:
+        tokens = count_tokens(text, model) + 1
+        if tokens > max_tokens:
+            pieces = split_long_text(text, max_tokens, model)
+        else:
+            pieces = [text]
+        for piece in pieces:
+            piece_tokens = tokens if len(pieces) == 1 else count_tokens(piece, model) + 1
+            if current and current_tokens + piece_tokens > max_tokens:
+                chunks.append(" ".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+class Summarizer:
+    """
+    Map-reduce summarization with the map calls running concurrently on a bounded
+    pool. Chunks are sized in tokens, and summaries that do not fit in one reduce
+    prompt are reduced in several rounds
+    """
+
+    def __init__(self, llm=None, chunk_tokens=CHUNK_TOKENS, max_concurrency=MAX_CONCURRENCY):
+        self.llm = llm or OpenAI(temperature=0)
+        self.chunk_tokens = chunk_tokens
+        self.max_concurrency = max_concurrency
+        self.chain = LLMChain(llm=self.llm, prompt=PROMPT)
+
+    @property
+    def model_name(self):
+        return getattr(self.llm, "model_name", None)
+
+    def chunk(self, texts):
+        return pack_by_tokens(texts, self.chunk_tokens, self.model_name)
+
+    async def summarize_chunk(self, text, semaphore):
+        async with semaphore:
+            return (await self.chain.arun(text=text)).strip()
+
+    async def map_step(self, chunks, semaphore, on_partial=None):
+        """
+        Summarizes every chunk concurrently. on_partial(index, summary, done, total)
+        is called as each summary arrives, in completion order
+        """
+        async def summarize(index, chunk):
+            return index, await self.summarize_chunk(chunk, semaphore)
+
+        summaries = [None] * len(chunks)
+        tasks = [asyncio.ensure_future(summarize(index, chunk)) for index, chunk in enumerate(chunks)]
+        try:
+            for done, task in enumerate(asyncio.as_completed(tasks), start=1):
+                index, summary = await task
+                summaries[index] = summary
+                if on_partial is not None:
+                    on_partial(index, summary, done, len(chunks))
+        finally:
+            for task in tasks:
+                task.cancel()
+        return summaries
+
+    async def reduce_step(self, summaries, semaphore):
+        """
+        Combines summaries into one. Summaries too long for one prompt are grouped,
+        the groups summarized concurrently, and so on until one prompt holds them
+        """
+        while True:
+            groups = pack_by_tokens(summaries, self.chunk_tokens, self.model_name)
+            if len(groups) == 1:
+                return await self.summarize_chunk(groups[0], semaphore)
+            summaries = await asyncio.gather(*(self.summarize_chunk(group, semaphore) for group in groups))
+
+    async def asummarize(self, chunks, on_partial=None):
+        if not chunks:
+            return ""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        summaries = await self.map_step(chunks, semaphore, on_partial)
+        if len(summaries) == 1:
+            return summaries[0]
+        return await self.reduce_step(summaries, semaphore)
+
+    def summarize(self, chunks, on_partial=None):
+        """
+        Summarizes the chunks returned by chunk()
+        """
+        return asyncio.run(self.asummarize(chunks, on_partial))
@@ -0,0 +1,29 @@
+from functools import lru_cache
+import tiktoken
+
+EMBEDDING_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model=None):
+    """
+    Returns the tiktoken encoder of a model, building an encoder is slow so each one is built once
+    """
+    if model is None:
+        return tiktoken.get_encoding(EMBEDDING_ENCODING)
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(EMBEDDING_ENCODING)
+
+
+def count_tokens(text, model=None):
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=16384)
+def count_tokens_cached(text, model=None):
+    """
+    count_tokens for texts counted again and again, like the chunks of a document
+    """
+    return count_tokens(text, model)
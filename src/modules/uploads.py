@@ -0,0 +1,61 @@
+import os
+import mmap
+import hashlib
+import tempfile
+from contextlib import contextmanager
+
+from modules.disk_cache import touch
+
+# Uploads are hashed and written in blocks of this size
+BLOCK_BYTES = 1024 * 1024
+
+
+def hash_bytes(data):
+    """
+    Hashes a bytes-like object block by block, without copying it
+    """
+    view = memoryview(data)
+    digest = hashlib.sha256()
+    for start in range(0, len(view), BLOCK_BYTES):
+        digest.update(view[start:start + BLOCK_BYTES])
+    return digest.hexdigest()
+
+
+@contextmanager
+def mapped(path):
+    """
+    Maps a file read-only, its pages are loaded by the OS as they are read
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+def hash_file(path):
+    with mapped(path) as data:
+        return hash_bytes(data)
+
+
+def spill(data, directory, extension):
+    """
+    Writes an upload to directory/{content hash}{extension} unless the same content
+    is already there, and returns (content hash, path)
+    """
+    content_hash = hash_bytes(data)
+    # Absolute, the path is handed to worker processes
+    path = os.path.join(os.path.abspath(directory), content_hash + extension)
+    if os.path.isfile(path):
+        touch(path)
+        return content_hash, path
+
+    os.makedirs(directory, exist_ok=True)
+    view = memoryview(data)
+    # Written under a temporary name so a concurrent reader never sees half a file
+    with tempfile.NamedTemporaryFile(dir=directory, prefix=".", suffix=".tmp", delete=False) as tmp_file:
+        for start in range(0, len(view), BLOCK_BYTES):
+            tmp_file.write(view[start:start + BLOCK_BYTES])
+    os.replace(tmp_file.name, path)
+    return content_hash, path
@@ -1,10 +1,20 @@
 import os
+import time
 import pandas as pd
 import streamlit as st
-import pdfplumber
 
-from modules.chatbot import Chatbot
+from modules.chatbot import Chatbot, VideoChatbot
+from modules.collection import DocumentCollection, collection_key
 from modules.embedder import Embedder
+from modules.jobs import INGESTION_JOBS
+from modules.uploads import mapped
+from modules.vector_cache import VECTOR_CACHE
+from modules.vector_io import vectors_exist
+from modules.youtube import TRANSCRIPT_WINDOW_SECONDS, transcript_documents
+
+# How often a session waiting for an ingestion job reruns to show its progress
+INGESTION_POLL_SECONDS = 1
+INGESTION_COUNTERS = {"pages": "pages parsed", "chunks": "chunks embedded"}
 
 class Utilities:
 
@@ -35,13 +45,16 @@ class Utilities:
 
     
     @staticmethod
-    def handle_upload(file_types):
+    def handle_upload(file_types, accept_multiple_files=False):
         """
         Handles and display uploaded_file
         :param file_types: List of accepted file types, e.g., ["csv", "pdf", "txt"]
+        :param accept_multiple_files: Returns a list of files instead of a single one
         """
-        uploaded_file = st.sidebar.file_uploader("upload", type=file_types, label_visibility="collapsed")
-        if uploaded_file is not None:
+        uploaded_file = st.sidebar.file_uploader(
+            "upload", type=file_types, label_visibility="collapsed", accept_multiple_files=accept_multiple_files
+        )
+        if uploaded_file:
 
             def show_csv_file(uploaded_file):
                 file_container = st.expander("Your CSV file :")
@@ -50,31 +63,36 @@ class Utilities:
                 file_container.write(shows)
 
             def show_pdf_file(uploaded_file):
-                file_container = st.expander("Your PDF file :")
-                with pdfplumber.open(uploaded_file) as pdf:
-                    pdf_text = ""
-                    for page in pdf.pages:
-                        pdf_text += page.extract_text() + "\n\n"
+                file_container = st.expander(f"Your PDF file : {uploaded_file.name}")
+                # Extracted by the ingestion job, the preview never parses the PDF on the script thread
+                content_hash, _ = Utilities.store_upload(uploaded_file)
+                pages = Embedder().getCachedPdfPages(content_hash)
+                if pages is None:
+                    file_container.write("The text is shown here once the PDF has been processed")
+                    return
+                pdf_text = "\n\n".join(text for _, text in pages)
                 file_container.write(pdf_text)
             
             def show_txt_file(uploaded_file):
-                file_container = st.expander("Your TXT file:")
-                uploaded_file.seek(0)
-                content = uploaded_file.read().decode("utf-8")
+                file_container = st.expander(f"Your TXT file: {uploaded_file.name}")
+                _, file_path = Utilities.store_upload(uploaded_file)
+                with mapped(file_path) as data:
+                    content = str(data, "utf-8")
                 file_container.write(content)
             
             def get_file_extension(uploaded_file):
                 return os.path.splitext(uploaded_file)[1].lower()
             
-            file_extension = get_file_extension(uploaded_file.name)
+            for file in (uploaded_file if accept_multiple_files else [uploaded_file]):
+                file_extension = get_file_extension(file.name)
 
-            # Show the contents of the file based on its extension
-            #if file_extension == ".csv" :
-            #    show_csv_file(uploaded_file)
-            if file_extension== ".pdf" : 
-                show_pdf_file(uploaded_file)
-            elif file_extension== ".txt" : 
-                show_txt_file(uploaded_file)
+                # Show the contents of the file based on its extension
+                #if file_extension == ".csv" :
+                #    show_csv_file(file)
+                if file_extension== ".pdf" : 
+                    show_pdf_file(file)
+                elif file_extension== ".txt" : 
+                    show_txt_file(file)
 
         else:
             st.session_state["reset_chat"] = True
@@ -83,23 +101,160 @@ class Utilities:
         return uploaded_file
 
     @staticmethod
-    def setup_chatbot(uploaded_file, model, temperature):
+    def setup_chatbot(uploaded_files, model, temperature, selected_names=None):
         """
-        Sets up the chatbot with the uploaded file, model, and temperature
+        Sets up the chatbot with the uploaded file(s), model, and temperature.
+        Several files are searched through one collection kept in the session,
+        selected_names restricts the search to some of them
         """
+        if not isinstance(uploaded_files, list):
+            uploaded_files = [uploaded_files]
         embeds = Embedder()
 
         with st.spinner("Processing..."):
-            uploaded_file.seek(0)
-            file = uploaded_file.read()
-            # Get the document embeddings for the uploaded file
-            vectors = embeds.getDocEmbeds(file, uploaded_file.name)
+            documents, pending = {}, []
+            for uploaded_file in uploaded_files:
+                # Hashed once per upload, the cache serves every rerun after the first
+                content_hash, file_path = Utilities.store_upload(uploaded_file, embeds)
+                cache_key = embeds.getCacheKey(content_hash, uploaded_file.name)
+
+                def load_vectors(file_path=file_path, content_hash=content_hash, name=uploaded_file.name):
+                    # Get the document embeddings for the uploaded file
+                    return embeds.getDocEmbeds(file_path, name, content_hash)
+
+                if not VECTOR_CACHE.contains(cache_key) and not vectors_exist(embeds.getCachePath(cache_key)):
+                    # New documents are ingested in the background, the script polls the job
+                    job = Utilities.submit_ingestion(embeds, file_path, content_hash, uploaded_file.name, cache_key)
+                    if not job.done:
+                        pending.append((uploaded_file.name, job))
+                        continue
+                    if job.error is not None:
+                        INGESTION_JOBS.forget(cache_key)
+                        raise job.error
+
+                documents[cache_key] = (uploaded_file.name, VECTOR_CACHE.get_vectors(cache_key, load_vectors))
 
-            # Create a Chatbot instance with the specified model and temperature
-            chatbot = Chatbot(model, temperature,vectors)
+            if pending:
+                Utilities.show_ingestion_progress(pending)
+                st.session_state["ready"] = False
+                time.sleep(INGESTION_POLL_SECONDS)
+                st.experimental_rerun()
+
+            if len(documents) == 1:
+                (cache_key, (_, vectors)), = documents.items()
+                # Create a Chatbot instance with the specified model and temperature
+                chatbot = VECTOR_CACHE.get_chatbot(
+                    cache_key, model, temperature, lambda: Chatbot(model, temperature, vectors, cache_key)
+                )
+            else:
+                chatbot = Utilities.setup_collection_chatbot(documents, model, temperature, selected_names)
         st.session_state["ready"] = True
 
+        stats = embeds.chunk_store.stats()
+        st.sidebar.caption(
+            f"Chunk embedding cache: {stats['hits']} hits / {stats['misses']} misses "
+            f"(~{stats['saved_tokens']} tokens, {stats['saved_seconds']:.1f}s saved)"
+        )
+        cache_stats = VECTOR_CACHE.stats()
+        st.sidebar.caption(
+            f"Vector store cache: {cache_stats['hit_rate']:.0%} of reruns served from memory "
+            f"({cache_stats['entries']} documents, {cache_stats['bytes'] / 1024 / 1024:.1f} MB)"
+        )
+
         return chatbot
 
+    @staticmethod
+    def store_upload(uploaded_file, embeds=None):
+        """
+        Returns the (content hash, path) of an uploaded file. It is hashed and
+        written to disk the first time, later reruns of the session reuse the result
+        """
+        uploads = st.session_state.setdefault("uploads", {})
+        upload_key = (uploaded_file.name, uploaded_file.size, uploaded_file.id)
+        stored = uploads.get(upload_key)
+        if stored is None or not os.path.isfile(stored[1]):
+            embeds = embeds or Embedder()
+            # getvalue() hands out the upload's own bytes, the file is never copied in memory
+            stored = uploads[upload_key] = embeds.storeUpload(uploaded_file.getvalue(), uploaded_file.name)
+        return stored
 
-    
+    @staticmethod
+    def submit_ingestion(embeds, file_path, content_hash, name, cache_key):
+        """
+        Starts embedding a document on the ingestion workers, a document already
+        being ingested, by this session or another one, is not submitted twice
+        """
+        def ingest(job):
+            VECTOR_CACHE.get_vectors(
+                cache_key, lambda: embeds.getDocEmbeds(file_path, name, content_hash, progress=job.report)
+            )
+
+        return INGESTION_JOBS.submit(cache_key, ingest, description=name)
+
+    @staticmethod
+    def index_video(video_id, transcript, embeds=None):
+        """
+        Starts embedding a video transcript in the background unless it already is
+        embedded. Returns its cache key and the job, None when there is nothing to do
+        """
+        embeds = embeds or Embedder()
+        cache_key = embeds.getVideoCacheKey(video_id, TRANSCRIPT_WINDOW_SECONDS)
+        if VECTOR_CACHE.contains(cache_key) or vectors_exist(embeds.getCachePath(cache_key)):
+            return cache_key, None
+
+        def ingest(job):
+            documents = transcript_documents(transcript, video_id)
+            VECTOR_CACHE.get_vectors(cache_key, lambda: embeds.getDocumentsEmbeds(documents, cache_key, progress=job.report))
+
+        return cache_key, INGESTION_JOBS.submit(cache_key, ingest, description=video_id)
+
+    @staticmethod
+    def setup_video_chatbot(video_id, transcript, model, temperature):
+        """
+        Returns the chatbot of a video, waiting for its transcript to be embedded
+        """
+        embeds = Embedder()
+        cache_key, job = Utilities.index_video(video_id, transcript, embeds)
+        if job is not None:
+            if not job.done:
+                Utilities.show_ingestion_progress([("the video for questions", job)])
+                time.sleep(INGESTION_POLL_SECONDS)
+                st.experimental_rerun()
+            if job.error is not None:
+                INGESTION_JOBS.forget(cache_key)
+                raise job.error
+
+        vectors = VECTOR_CACHE.get_vectors(
+            cache_key, lambda: embeds.getDocumentsEmbeds(transcript_documents(transcript, video_id), cache_key)
+        )
+        return VECTOR_CACHE.get_chatbot(
+            cache_key, model, temperature, lambda: VideoChatbot(model, temperature, vectors, cache_key)
+        )
+
+    @staticmethod
+    def show_ingestion_progress(pending):
+        for name, job in pending:
+            progress = job.snapshot()
+            counters = [f"{progress[counter]} {label}" for counter, label in INGESTION_COUNTERS.items() if counter in progress]
+            st.info(f"Processing {name}: " + (", ".join(counters) if counters else job.status))
+
+    @staticmethod
+    def setup_collection_chatbot(documents, model, temperature, selected_names=None):
+        """
+        Brings the session's collection in line with the uploaded documents, only
+        the added and removed files change the shared index, and returns its chatbot
+        """
+        collection = st.session_state.setdefault("collection", DocumentCollection())
+        collection.sync(documents)
+
+        chatbot = st.session_state.get("collection_chatbot")
+        if chatbot is None:
+            chatbot = st.session_state["collection_chatbot"] = Chatbot(model, temperature, collection.vectors)
+        # The chain is rebuilt if the model, temperature or vectors changed
+        chatbot.model_name, chatbot.temperature, chatbot.vectors = model, temperature, collection.vectors
+
+        selected = [doc_key for doc_key, name in collection.names.items() if selected_names is None or name in selected_names]
+        chatbot.chain.retriever.doc_filter = None if len(selected) == len(collection.names) else set(selected)
+        # Answers depend on the documents searched
+        chatbot.doc_key = collection_key(selected)
+        return chatbot
@@ -0,0 +1,99 @@
+import os
+import threading
+from collections import OrderedDict
+
+from modules.indexing import estimate_index_bytes
+
+
+def estimate_vectors_size(vectors):
+    """
+    Estimates the memory used by a FAISS vector store in bytes
+    """
+    index_bytes = estimate_index_bytes(vectors.index)
+    docstore_bytes = sum(len(doc.page_content) for doc in vectors.docstore._dict.values())
+    return index_bytes + docstore_bytes
+
+
+class VectorStoreCache:
+    """
+    Process-wide LRU cache of loaded vector stores and their chatbots, keyed
+    by document hash and shared by every Streamlit session
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _key_lock(self, key):
+        with self.lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+    def contains(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def get_vectors(self, key, loader):
+        """
+        Returns the vector store of a document, calling loader only if it is not cached
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]["vectors"]
+
+        # One loader per document, sessions opening it at the same time wait for it
+        with self._key_lock(key):
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return self.entries[key]["vectors"]
+            vectors = loader()
+            with self.lock:
+                self.misses += 1
+                self.entries[key] = {"vectors": vectors, "size": estimate_vectors_size(vectors), "chatbots": {}}
+                self._evict(keep=key)
+                self.key_locks.pop(key, None)
+        return vectors
+
+    def get_chatbot(self, key, model, temperature, factory):
+        """
+        Returns the chatbot of a cached document for a model and temperature,
+        calling factory to build it the first time
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return factory()
+            chatbot = entry["chatbots"].get((model, temperature))
+            if chatbot is None:
+                chatbot = entry["chatbots"][(model, temperature)] = factory()
+            return chatbot
+
+    def _evict(self, keep):
+        total = sum(entry["size"] for entry in self.entries.values())
+        for key in list(self.entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self.entries.pop(key)["size"]
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self.entries),
+                "bytes": sum(entry["size"] for entry in self.entries.values()),
+            }
+
+
+VECTOR_CACHE = VectorStoreCache(int(os.environ.get("ROBBY_VECTOR_CACHE_MB", "512")) * 1024 * 1024)
@@ -0,0 +1,115 @@
+import os
+import json
+import threading
+import faiss
+from langchain.docstore.document import Document
+from langchain.docstore.in_memory import InMemoryDocstore
+from langchain.vectorstores import FAISS
+
+from modules.lexical import BM25Index
+
+INDEX_SUFFIX = ".faiss"
+DOCSTORE_SUFFIX = ".jsonl"
+LEXICAL_SUFFIX = ".bm25.json.gz"
+
+
+def vectors_exist(path_prefix):
+    return os.path.isfile(path_prefix + INDEX_SUFFIX) and os.path.isfile(path_prefix + DOCSTORE_SUFFIX)
+
+
+def save_vectors(vectors, path_prefix):
+    """
+    Saves a FAISS vector store as the raw FAISS index plus a JSONL docstore,
+    one line per vector in index order, and its BM25 index when it has one
+    """
+    index_path, docstore_path = path_prefix + INDEX_SUFFIX, path_prefix + DOCSTORE_SUFFIX
+
+    # Write to temporary files first so a concurrent reader never sees half a store
+    faiss.write_index(vectors.index, index_path + ".tmp")
+    with open(docstore_path + ".tmp", "w", encoding="utf-8") as f:
+        for position in range(len(vectors.index_to_docstore_id)):
+            doc_id = vectors.index_to_docstore_id[position]
+            doc = vectors.docstore.search(doc_id)
+            f.write(json.dumps({"id": doc_id, "page_content": doc.page_content, "metadata": doc.metadata}) + "\n")
+
+    lexical_index = getattr(vectors, "lexical_index", None)
+    if lexical_index is not None:
+        lexical_index.save(path_prefix + LEXICAL_SUFFIX + ".tmp")
+        os.replace(path_prefix + LEXICAL_SUFFIX + ".tmp", path_prefix + LEXICAL_SUFFIX)
+    os.replace(docstore_path + ".tmp", docstore_path)
+    os.replace(index_path + ".tmp", index_path)
+
+
+def read_index(index_path):
+    """
+    Reads a FAISS index memory-mapped without copying: the vectors of flat and HNSW
+    indexes and the inverted lists of IVF indexes stay in the file, so opening a
+    store is fast and sessions opening the same document share the OS page cache.
+    Returns (index, mapped), a mapped index is read-only
+    """
+    try:
+        return faiss.read_index(index_path, faiss.IO_FLAG_MMAP_IFC), True
+    except RuntimeError:
+        # Index types that cannot be memory-mapped are read into memory
+        return faiss.read_index(index_path), False
+
+
+def owned_copy(index):
+    # clone_index keeps viewing the mapped file, a serialized copy owns its vectors
+    return faiss.deserialize_index(faiss.serialize_index(index))
+
+
+class MappedFAISS(FAISS):
+    """
+    FAISS store over a memory-mapped index. Changing a mapped index aborts the
+    whole process instead of raising, so the vectors are copied into memory before
+    the store's first change. Searching never copies them
+    """
+
+    def __init__(self, *args, mapped=True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.mapped = mapped
+        self.own_lock = threading.Lock()
+
+    def own_index(self):
+        with self.own_lock:
+            if self.mapped:
+                self.index = owned_copy(self.index)
+                self.mapped = False
+
+    def add_texts(self, *args, **kwargs):
+        self.own_index()
+        return super().add_texts(*args, **kwargs)
+
+    def add_embeddings(self, *args, **kwargs):
+        self.own_index()
+        return super().add_embeddings(*args, **kwargs)
+
+    def merge_from(self, target):
+        self.own_index()
+        if getattr(target, "mapped", False):
+            # FAISS empties the index merged from, the shared mapped store is left as it is
+            target = FAISS(target.embedding_function, owned_copy(target.index), target.docstore, target.index_to_docstore_id)
+        return super().merge_from(target)
+
+
+def load_vectors(path_prefix, embeddings):
+    """
+    Loads a FAISS vector store saved by save_vectors
+    """
+    index, mapped = read_index(path_prefix + INDEX_SUFFIX)
+
+    documents = {}
+    index_to_docstore_id = {}
+    with open(path_prefix + DOCSTORE_SUFFIX, "r", encoding="utf-8") as f:
+        for position, line in enumerate(f):
+            record = json.loads(line)
+            documents[record["id"]] = Document(page_content=record["page_content"], metadata=record["metadata"])
+            index_to_docstore_id[position] = record["id"]
+
+    vectors = MappedFAISS(embeddings.embed_query, index, InMemoryDocstore(documents), index_to_docstore_id, mapped=mapped)
+    # The lexical index travels with the store, the retriever picks it up when present
+    vectors.lexical_index = None
+    if os.path.isfile(path_prefix + LEXICAL_SUFFIX):
+        vectors.lexical_index = BM25Index.load(path_prefix + LEXICAL_SUFFIX)
+    return vectors
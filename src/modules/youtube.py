@@ -0,0 +1,131 @@
+import os
+import re
+import gzip
+import json
+import hashlib
+import threading
+from langchain.docstore.document import Document
+from youtube_transcript_api import YouTubeTranscriptApi
+
+from modules.disk_cache import evict_lru, touch
+
+TRANSCRIPT_LANGUAGES = ('en', 'fr', 'es', 'zh-cn', 'hi', 'ar', 'bn', 'ru', 'pt', 'sw')
+VIDEO_ID_PATTERN = re.compile(r"[\w-]+")
+# Transcripts are embedded in windows of this many seconds of speech
+TRANSCRIPT_WINDOW_SECONDS = 60
+
+
+def fetch_youtube_transcript(video_id):
+    """
+    Returns the transcript segments of a video, dicts with text, start and duration
+    """
+    return YouTubeTranscriptApi.get_transcript(video_id, languages=TRANSCRIPT_LANGUAGES)
+
+
+def format_timestamp(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+
+def transcript_documents(transcript, video_id, window_seconds=TRANSCRIPT_WINDOW_SECONDS):
+    """
+    Groups transcript segments into documents covering about window_seconds each.
+    Documents start with their [start - end] timestamps, which the answers cite
+    """
+    documents, window = [], []
+
+    def flush():
+        start = window[0]["start"]
+        end = window[-1]["start"] + window[-1].get("duration", 0)
+        text = " ".join(segment["text"].replace("\n", " ") for segment in window)
+        documents.append(Document(
+            page_content=f"[{format_timestamp(start)} - {format_timestamp(end)}] {text}",
+            metadata={"source": f"https://youtu.be/{video_id}?t={int(start)}", "start": start, "end": end},
+        ))
+
+    for segment in transcript:
+        if window and segment["start"] - window[0]["start"] >= window_seconds:
+            flush()
+            window = []
+        window.append(segment)
+    if window:
+        flush()
+    return documents
+
+
+class VideoCache:
+    """
+    Transcripts (gzipped) and summaries of videos on disk, shared by every session.
+    Files of a video share its id as prefix, so a video is evicted with its summaries.
+    fetcher(video_id) returns the transcript segments, a local stand-in can replace YouTube
+    """
+
+    def __init__(self, directory, max_bytes, fetcher=fetch_youtube_transcript):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.fetcher = fetcher
+        self.lock = threading.Lock()
+        self.key_locks = {}
+
+    def key_lock(self, key):
+        """
+        Lock held while a transcript is fetched or a summary generated, sessions
+        asking for the same one wait for it instead of doing the work again
+        """
+        with self.lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+    def path(self, video_id, suffix):
+        if not VIDEO_ID_PATTERN.fullmatch(video_id):
+            raise ValueError(f"Invalid video id: {video_id}")
+        return os.path.join(self.directory, video_id + suffix)
+
+    def read(self, path):
+        if not os.path.isfile(path):
+            return None
+        touch(path)
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    def write(self, path, data, video_id):
+        os.makedirs(self.directory, exist_ok=True)
+        with gzip.open(path + ".tmp", "wt", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+        evict_lru(self.directory, self.max_bytes, keep=(video_id,))
+
+    def get_transcript(self, video_id):
+        path = self.path(video_id, ".transcript.json.gz")
+        transcript = self.read(path)
+        if transcript is not None:
+            return transcript
+        with self.key_lock(path):
+            transcript = self.read(path)
+            if transcript is None:
+                transcript = self.fetcher(video_id)
+                self.write(path, transcript, video_id)
+        return transcript
+
+    def summary_path(self, video_id, model, chunk_params):
+        params = hashlib.sha256(f"{model}:{chunk_params}".encode("utf-8")).hexdigest()[:16]
+        return self.path(video_id, f".summary-{params}.json.gz")
+
+    def get_summary(self, video_id, model, chunk_params, summarize):
+        """
+        Returns the summary of a video for a model and chunking parameters,
+        calling summarize() only the first time
+        """
+        path = self.summary_path(video_id, model, chunk_params)
+        summary = self.read(path)
+        if summary is not None:
+            return summary["summary"]
+        with self.key_lock(path):
+            summary = self.read(path)
+            if summary is None:
+                summary = {"summary": summarize()}
+                self.write(path, summary, video_id)
+        return summary["summary"]
+
+
+VIDEO_CACHE = VideoCache("embeddings/youtube", int(os.environ.get("ROBBY_YOUTUBE_CACHE_MB", "256")) * 1024 * 1024)
@@ -1,12 +1,10 @@
 import os
 import streamlit as st
-from io import StringIO
-import re
-import sys
 from modules.history import ChatHistory
 from modules.layout import Layout
 from modules.utils import Utilities
 from modules.sidebar import Sidebar
+from modules.callbacks import StreamHandler
 
 #To be able to update the changes made to modules in localhost (press r)
 def reload_module(module_name):
@@ -40,19 +38,20 @@ if not user_api_key:
 else:
     os.environ["OPENAI_API_KEY"] = user_api_key
 
-    uploaded_file = utils.handle_upload(["pdf", "txt", "csv"])
+    uploaded_files = utils.handle_upload(["pdf", "txt", "csv"], accept_multiple_files=True)
 
-    if uploaded_file:
+    if uploaded_files:
 
         # Configure the sidebar
         sidebar.show_options()
+        selected_names = sidebar.document_filter([file.name for file in uploaded_files])
         sidebar.about()
 
         # Initialize chat history
         history = ChatHistory()
         try:
             chatbot = utils.setup_chatbot(
-                uploaded_file, st.session_state["model"], st.session_state["temperature"]
+                uploaded_files, st.session_state["model"], st.session_state["temperature"], selected_names
             )
             st.session_state["chatbot"] = chatbot
 
@@ -65,33 +64,45 @@ else:
                     is_ready, user_input = layout.prompt_form()
 
                     # Initialize the chat history
-                    history.initialize(uploaded_file)
+                    history.initialize(uploaded_files)
 
                     # Reset the chat history if button clicked
                     if st.session_state["reset_chat"]:
-                        history.reset(uploaded_file)
+                        history.reset(uploaded_files)
 
                     if is_ready:
                         # Update the chat history and display the chat messages
                         history.append("user", user_input)
 
-                        old_stdout = sys.stdout
-                        sys.stdout = captured_output = StringIO()
-
-                        output = st.session_state["chatbot"].conversational_chat(user_input)
-
-                        sys.stdout = old_stdout
+                        # Stream the answer tokens while they are generated
+                        answer_placeholder = st.empty()
+                        output = st.session_state["chatbot"].conversational_chat(
+                            user_input, callbacks=[StreamHandler(answer_placeholder)]
+                        )
+                        answer_placeholder.empty()
+
+                        usage = st.session_state["last_usage"]
+                        if usage["cached"]:
+                            st.caption("Served from the answer cache")
+                        else:
+                            st.caption(
+                                f"Prompt: {usage['prompt_tokens']} tokens, "
+                                f"{usage['context_tokens']} of context from {usage['chunks']} chunks"
+                            )
+
+                        timings = st.session_state["last_timings"]
+                        latencies = st.session_state["latency_by_strategy"][timings["strategy"]]
+                        st.caption(
+                            f"Turn latency ({timings['strategy']}): {timings['total']:.2f}s, "
+                            f"condense {timings['condense']:.2f}s, retrieve {timings.get('retrieve', 0):.2f}s, "
+                            f"answer {timings.get('answer', 0):.2f}s | "
+                            f"average {sum(latencies) / len(latencies):.2f}s over {len(latencies)} turns"
+                        )
 
                         history.append("assistant", output)
 
-                        # Clean up the agent's thoughts to remove unwanted characters
-                        thoughts = captured_output.getvalue()
-                        cleaned_thoughts = re.sub(r'\x1b\[[0-9;]*[a-zA-Z]', '', thoughts)
-                        cleaned_thoughts = re.sub(r'\[1m>', '', cleaned_thoughts)
-
-                        # Display the agent's thoughts
-                        with st.expander("Display the agent's thoughts"):
-                            st.write(cleaned_thoughts)
+                        # Display the steps the chatbot took to answer
+                        layout.show_trace(st.session_state["last_trace"])
 
                 history.generate_messages(response_container)
         except Exception as e:
@@ -1,10 +1,9 @@
 import os
 import importlib
 import sys
-import pandas as pd
 import streamlit as st
-from io import BytesIO
 from modules.robby_sheet.table_tool import PandasAgent
+from modules.robby_sheet.table_cache import TABLE_CACHE, PREVIEW_ROWS
 from modules.layout import Layout
 from modules.utils import Utilities
 from modules.sidebar import Sidebar
@@ -44,13 +43,21 @@ else:
     if uploaded_file:
         sidebar.about()
         
-        uploaded_file_content = BytesIO(uploaded_file.getvalue())
-        if uploaded_file.type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" or uploaded_file.type == "application/vnd.ms-excel":
-            df = pd.read_excel(uploaded_file_content)
-        else:
-            df = pd.read_csv(uploaded_file_content)
-
-        st.session_state.df = df
+        # Read from the copy spilled to disk, not from another in-memory copy of the upload
+        content_hash, file_path = utils.store_upload(uploaded_file)
+        is_excel = uploaded_file.type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" or uploaded_file.type == "application/vnd.ms-excel"
+
+        # Parsed once per content, the session's reruns reuse its DataFrame
+        if st.session_state.get("df_hash") != content_hash:
+            try:
+                st.session_state.df, st.session_state.df_lazy = TABLE_CACHE.get_dataframe(file_path, content_hash, is_excel)
+            except Exception as e:
+                st.error(f"Error: {str(e)}")
+                st.stop()
+            st.session_state.df_hash = content_hash
+        df = st.session_state.df
+        if st.session_state.df_lazy:
+            st.warning(f"This file is too large to load at once, questions the local planner cannot answer only see its first {PREVIEW_ROWS} rows")
 
         if "chat_history" not in st.session_state:
             st.session_state["chat_history"] = []
@@ -66,11 +73,13 @@ else:
             if reset_chat_button:
                 st.session_state["chat_history"] = []
         if submitted_query:
-            result, captured_output = csv_agent.get_agent_response(df, query)
-            cleaned_thoughts = csv_agent.process_agent_thoughts(captured_output)
-            csv_agent.display_agent_thoughts(cleaned_thoughts)
+            # Files too large for pandas are queried through their memory-mapped table
+            table = TABLE_CACHE.get_table(file_path, content_hash, is_excel) if st.session_state.df_lazy else None
+            result, trace = csv_agent.get_agent_response(df, query, table)
+            layout.show_trace(trace.rows())
             csv_agent.update_chat_history(query, result)
             csv_agent.display_chat_history()
+            csv_agent.display_planner_stats()
         if st.session_state.df is not None:
             st.subheader("Current dataframe:")
             st.write(st.session_state.df)
@@ -1,16 +1,13 @@
 import os
 import streamlit as st
 import re
+from modules.callbacks import StreamHandler
+from modules.history import ChatHistory
 from modules.layout import Layout
 from modules.utils import Utilities
 from modules.sidebar import Sidebar
-from youtube_transcript_api import YouTubeTranscriptApi
-from langchain.chains.summarize import load_summarize_chain
-from langchain.chains import AnalyzeDocumentChain
-from youtube_transcript_api import YouTubeTranscriptApi
-from langchain.llms import OpenAI
-import os
-from langchain.text_splitter import CharacterTextSplitter
+from modules.summarizer import Summarizer
+from modules.youtube import VIDEO_CACHE
 
 st.set_page_config(layout="wide", page_icon="💬", page_title="Robby | Chat-Bot 🤖")
 
@@ -51,21 +48,59 @@ else:
     if video_url :
         video_id = get_youtube_id(video_url)
 
-        if video_id != "":
-            t = YouTubeTranscriptApi.get_transcript(video_id, languages=('en','fr','es', 'zh-cn', 'hi', 'ar', 'bn', 'ru', 'pt', 'sw' ))
-            finalString = ""
-            for item in t:
-                text = item['text']
-                finalString += text + " "
+        if video_id:
+            # Fetched and summarized once per video, every session and rerun reads the cache
+            t = VIDEO_CACHE.get_transcript(video_id)
+            # The transcript is embedded in the background while the summary is generated
+            utils.index_video(video_id, t)
+            summarizer = Summarizer()
+
+            def summarize():
+                chunks = summarizer.chunk([item['text'] for item in t])
+
+                # Chunk summaries are shown as they arrive, the full summary replaces them
+                progress = st.progress(0.0)
+                partials = st.expander("Summaries of each part", expanded=True)
+                placeholders = [partials.empty() for _ in chunks]
 
-            text_splitter = CharacterTextSplitter()
-            chunks = text_splitter.split_text(finalString)
+                def show_partial(index, summary, done, total):
+                    progress.progress(done / total)
+                    placeholders[index].markdown(f"**Part {index + 1}/{total}:** {summary}")
 
-            summary_chain = load_summarize_chain(OpenAI(temperature=0),
-                                            chain_type="map_reduce",verbose=True)
-            
-            summarize_document_chain = AnalyzeDocumentChain(combine_docs_chain=summary_chain)
+                summary = summarizer.summarize(chunks, on_partial=show_partial)
+                progress.empty()
+                return summary
 
-            answer = summarize_document_chain.run(chunks)
+            answer = VIDEO_CACHE.get_summary(video_id, summarizer.model_name, summarizer.chunk_tokens, summarize)
 
             st.subheader(answer)
+
+            # Follow-up questions about the video, answered from its embedded transcript
+            sidebar.show_options()
+            history = ChatHistory(namespace="youtube")
+            chatbot = utils.setup_video_chatbot(
+                video_id, t, st.session_state["model"], st.session_state["temperature"]
+            )
+
+            response_container, prompt_container = st.container(), st.container()
+            with prompt_container:
+                is_ready, user_input = layout.prompt_form()
+
+                history.initialize("this video")
+                # A new video starts a new conversation
+                if st.session_state["reset_chat"] or st.session_state.get("youtube_video_id") != video_id:
+                    history.reset("this video")
+                    st.session_state["youtube_video_id"] = video_id
+
+                if is_ready:
+                    history.append("user", user_input)
+
+                    answer_placeholder = st.empty()
+                    output = chatbot.conversational_chat(
+                        user_input, callbacks=[StreamHandler(answer_placeholder)], chat_history=history.history
+                    )
+                    answer_placeholder.empty()
+
+                    history.append("assistant", output)
+
+            history.generate_messages(response_container)
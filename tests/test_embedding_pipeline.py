@@ -0,0 +1,126 @@
+import random
+import threading
+import time
+
+import openai
+import pytest
+from langchain.docstore.document import Document
+
+from modules import embedding_pipeline
+from modules.embedding_pipeline import EmbeddingPipeline, RateLimiter, TokenBucket
+
+
+def documents(count):
+    return [Document(page_content=f"chunk-{i}") for i in range(count)]
+
+
+def fake_embed(texts):
+    # Finishes batches out of order, the vector gives the chunk number back
+    time.sleep(random.uniform(0, 0.01))
+    return [[float(text.split("-")[1])] for text in texts]
+
+
+def pipeline(embed_fn, **kwargs):
+    return EmbeddingPipeline(embed_fn, backoff=0, limit_key="tests", **kwargs)
+
+
+def test_batches_come_back_in_order():
+    results = list(pipeline(fake_embed, batch_size=3, max_workers=4).run(documents(50)))
+
+    assert [len(batch) for batch, _ in results] == [3] * 16 + [2]
+    chunks = [doc.page_content for batch, _ in results for doc in batch]
+    vectors = [vector[0] for _, batch_vectors in results for vector in batch_vectors]
+    assert chunks == [f"chunk-{i}" for i in range(50)]
+    assert vectors == list(range(50))
+
+
+@pytest.mark.parametrize("error", [
+    openai.error.RateLimitError("slow down"),
+    openai.error.ServiceUnavailableError("busy"),
+    type("TooManyRequests", (Exception,), {"http_status": 429})(),
+])
+def test_retries_transient_errors(error):
+    calls = []
+
+    def flaky_embed(texts):
+        calls.append(texts)
+        if len(calls) < 3:
+            raise error
+        return fake_embed(texts)
+
+    embedder = pipeline(flaky_embed, batch_size=10)
+    results = list(embedder.run(documents(5)))
+
+    assert len(calls) == 3
+    assert embedder.retries == 2
+    assert [vector[0] for vector in results[0][1]] == list(range(5))
+
+
+def test_does_not_retry_other_errors():
+    calls = []
+
+    def broken_embed(texts):
+        calls.append(texts)
+        raise openai.error.AuthenticationError("bad key")
+
+    embedder = pipeline(broken_embed, batch_size=10)
+    with pytest.raises(openai.error.AuthenticationError):
+        list(embedder.run(documents(5)))
+
+    assert len(calls) == 1
+    assert embedder.retries == 0
+
+
+def test_gives_up_after_max_retries():
+    calls = []
+
+    def failing_embed(texts):
+        calls.append(texts)
+        raise openai.error.RateLimitError("slow down")
+
+    with pytest.raises(openai.error.RateLimitError):
+        list(pipeline(failing_embed, batch_size=10, max_retries=2).run(documents(5)))
+
+    assert len(calls) == 3
+
+
+def test_stopping_early_cancels_queued_batches():
+    calls = []
+    lock = threading.Lock()
+
+    def slow_embed(texts):
+        with lock:
+            calls.append(texts)
+        time.sleep(0.02)
+        return fake_embed(texts)
+
+    results = pipeline(slow_embed, batch_size=1, max_workers=2).run(documents(40))
+    next(results)
+    results.close()
+
+    # Only the batches already in flight were sent, at most two per worker
+    assert len(calls) <= 4
+
+
+def test_token_bucket_charges_large_requests_in_full(monkeypatch):
+    waits = []
+    monkeypatch.setattr(embedding_pipeline.time, "sleep", waits.append)
+    bucket = TokenBucket(rate=100, capacity=100)
+
+    bucket.acquire(100)
+    assert waits == []
+    # Ten times the capacity is paid back at the refill rate, not capped at the capacity
+    bucket.acquire(1000)
+    assert waits[0] == pytest.approx(10, abs=0.1)
+    # The next request waits behind the debt
+    bucket.acquire(1)
+    assert waits[1] == pytest.approx(10, abs=0.1)
+
+
+def test_pipelines_of_one_key_share_a_limiter():
+    first = EmbeddingPipeline(fake_embed, limit_key="shared")
+    second = EmbeddingPipeline(fake_embed, limit_key="shared")
+    other = EmbeddingPipeline(fake_embed, limit_key="other")
+
+    assert first.limiter is second.limiter is RateLimiter.get("shared")
+    assert other.limiter is not first.limiter
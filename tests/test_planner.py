@@ -0,0 +1,123 @@
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from modules.robby_sheet.planner import QueryPlanner
+
+DF = pd.DataFrame({
+    "product": ["Widget", "Gadget", "Widget", "Gizmo"],
+    "region": ["North", "South", "South", "North"],
+    "price": [10.0, 25.0, 12.0, 7.5],
+    "units": [3, 1, 4, 2],
+})
+COLUMNS = list(DF.columns)
+NUMERIC = ["price", "units"]
+
+
+def plan(question):
+    return QueryPlanner().plan(question, COLUMNS, NUMERIC)
+
+
+def answer(question):
+    return plan(question).run(DF)
+
+
+@pytest.mark.parametrize("question, expected", [
+    ("How many rows are there?", "4"),
+    ("How many rows are in the file?", "4"),
+    ("How many columns?", "4"),
+    ("List the columns", "product, region, price, units"),
+    ("What is the total units?", "10"),
+    ("Sum of units", "10"),
+    ("What is the average price?", "13.625"),
+    ("What is the highest price?", "25"),
+    ("Lowest price", "7.5"),
+    ("Median units", "2.5"),
+    ("How many unique product?", "3"),
+    ("Sum of units where region is north", "5"),
+    ("Average price where units > 1", "9.8333"),
+])
+def test_scalar_answers(question, expected):
+    assert answer(question) == expected
+
+
+def test_first_and_last_rows():
+    assert plan("Show the first 2 rows").compute(DF).equals(DF.head(2))
+    assert plan("last 1 rows").compute(DF).equals(DF.tail(1))
+
+
+def test_top_and_bottom_by_column():
+    assert list(plan("top 2 by price").compute(DF)["price"]) == [25.0, 12.0]
+    assert list(plan("bottom 1 by units").compute(DF)["units"]) == [1]
+
+
+def test_row_plans_on_arrow_table():
+    table = pa.Table.from_pandas(DF, preserve_index=False)
+    for question in ("first 2 rows", "last 3 rows", "top 2 by price", "bottom 2 by units"):
+        selected = plan(question)
+        assert selected.run_table(table) == selected.run(DF)
+
+
+def test_filtered_row_plans_have_no_table_path():
+    assert plan("first 2 rows where region is north").compute_table is None
+
+
+def test_group_by():
+    assert plan("sum of units per region").compute(DF).to_dict() == {"South": 5, "North": 5}
+    assert plan("average price for each product").compute(DF)["Gadget"] == 25.0
+    assert plan("count by region").compute(DF).to_dict() == {"North": 2, "South": 2}
+
+
+def test_distinct_values():
+    assert list(plan("distinct product").compute(DF)) == ["Widget", "Gadget", "Gizmo"]
+
+
+@pytest.mark.parametrize("question", [
+    # The answer is another column than the aggregated one
+    "Which product has the highest price?",
+    "Who has the highest units?",
+    "What product has the lowest price?",
+    "What is the product with the highest price?",
+    # Conditions the planner cannot read
+    "What is the highest price for product Widget?",
+    "What is the highest price for Widget?",
+    "lowest price in the North region",
+    "Sum of price except the Gadget",
+    # Aggregating text
+    "What is the highest product?",
+    "average region per product",
+    "top 2 by product",
+    # Several columns where the plan uses one
+    "top 2 by price and units",
+    "first 2 rows of product",
+    "distinct product and region",
+    "sum of price and units",
+    # Words the plan would ignore: a value to filter on, a qualifier
+    "How many rows have region North?",
+    "Count rows of region North",
+    "How many columns are numeric?",
+    "sum of units of Widget",
+    "average price of Gadget",
+    # Compound or qualified filter values
+    "Sum of units where region is north and price > 10",
+    "Sum of units where region is north or south",
+    "Sum of units where region is north, sorted",
+    "average price where region is north and units is 3",
+    # First/last with an order is ambiguous
+    "last 2 rows by price",
+    "first 2 rows by units",
+    # Not a question the planner knows
+    "Plot the price of each product",
+])
+def test_falls_back(question):
+    assert plan(question) is None
+
+
+def test_text_filter_on_number_column_raises():
+    with pytest.raises(ValueError):
+        answer("sum of units where price is cheap")
+
+
+def test_text_filter_matching_nothing_raises():
+    with pytest.raises(ValueError):
+        answer("sum of units where region is north america")
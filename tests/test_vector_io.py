@@ -0,0 +1,34 @@
+from langchain.embeddings import FakeEmbeddings
+from langchain.vectorstores import FAISS
+
+from modules.vector_io import load_vectors, save_vectors
+
+EMBEDDINGS = FakeEmbeddings(size=16)
+
+
+def saved_store(tmp_path, name, texts):
+    save_vectors(FAISS.from_texts(texts, EMBEDDINGS), str(tmp_path / name))
+    return load_vectors(str(tmp_path / name), EMBEDDINGS)
+
+
+def test_loaded_store_is_mapped(tmp_path):
+    assert saved_store(tmp_path, "a", ["one", "two"]).mapped
+
+
+def test_adding_to_a_loaded_store_copies_its_index(tmp_path):
+    vectors = saved_store(tmp_path, "a", ["one", "two"])
+    vectors.add_texts(["three"])
+    vectors.add_embeddings([("four", EMBEDDINGS.embed_query("four"))])
+    assert not vectors.mapped
+    assert vectors.index.ntotal == 4
+    # The file on disk is unchanged
+    assert load_vectors(str(tmp_path / "a"), EMBEDDINGS).index.ntotal == 2
+
+
+def test_merging_a_loaded_store_leaves_it_intact(tmp_path):
+    vectors = saved_store(tmp_path, "a", ["one", "two"])
+    other = saved_store(tmp_path, "b", ["three"])
+    vectors.merge_from(other)
+    assert vectors.index.ntotal == 3
+    assert other.mapped and other.index.ntotal == 1
+    assert len(other.similarity_search("three", k=1)) == 1